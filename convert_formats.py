@@ -1,30 +1,17 @@
-# This does not use the library, it is just a way to convert the raw files to pngs
+# Converts the raw files of a folder to pngs, same as `lumix-control convert INPUT -o OUTPUT`
 
 import os
-import re
 
+from lumix_control import convert
 
-def convert_to_png(input_file, output_file):
-    # use darktable-cli to convert the raw file to a png
-    os.system("darktable-cli " + input_file + " " + output_file)
 
-
-def convert_all_files(input_folder, output_folder, skip_existing=True):
-    # get all the files in the input folder
-    files = os.listdir(input_folder)
-
-    # loop through all the files
-    for file in files:
-        # get the file name without the extension
-        file_name = os.path.splitext(file)[0]
-
-        # check if the file is a raw file
-        if re.search(".*\\.RAW", file):
-            # convert the file to a png
-            if os.path.isfile(output_folder + file_name + ".png") and skip_existing:
-                print("File " + file_name + ".png already exists")
-                continue
-            convert_to_png(os.path.join(input_folder + file), os.path.join(output_folder + file_name + ".png"))
+def convert_all_files(input_folder, output_folder, skip_existing=True, jobs=0):
+    converter = convert.Converter(output_folder, jobs, force=not skip_existing)
+    try:
+        futures = [future for future in map(converter.submit, convert.list_raw_files([input_folder])) if future is not None]
+        convert.report(futures, len(futures))
+    finally:
+        converter.close()
 
 if __name__ == "__main__":
     input_folder = os.path.join(os.getenv("HOME"), "Pictures/pana/raw/")
@@ -32,4 +19,3 @@ if __name__ == "__main__":
 
     # convert all the files
     convert_all_files(input_folder, output_folder)
-    
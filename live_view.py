@@ -1,63 +1,39 @@
 import lumix_control
-from PIL import Image, ImageTk
-import io
-import time
-import socket
+from lumix_control.live_view import LiveViewReceiver, LiveViewPipeline, StreamSupervisor
+from PIL import ImageTk
 from tkinter import Tk, Label
-from threading import Thread
-
-#This gets more and more out of sync.
 
 IP = "192.168.54.1" #IP of camera
 control = lumix_control.CameraControl(IP)
 my_ip = "0.0.0.0"
 my_stream_port = 12345
 
-def connect():
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.bind((my_ip, my_stream_port))
-    s.settimeout(10)
-    return s
-
-control.start_stream(my_stream_port)
+receiver = LiveViewReceiver(my_stream_port, my_ip).start()
+# Sends the keepalives and restarts the stream if frames stop coming
+supervisor = StreamSupervisor(control, receiver, my_stream_port).start()
 
 root = Tk()
 
 label = Label()
 label.pack()
 
-def daemon():
-    stream_socket = connect()
-    t = time.time()
-    while 1:
-        try:
-            data = stream_socket.recv(1024 * 512 * 1) # 0.5MB
-            data = data[data.find(b'\xff\xd8'):]
-        except socket.timeout:
-            control.start_stream(my_stream_port)
-            continue
-        if not data:
-            control.start_stream(my_stream_port)
-            continue
-        if time.time() - t > 5:
-            control.get_state()
-            t = time.time()
-        if data[-2:] != b'\xff\xd9':
-            print('no end of jpeg found from stream')
-            continue
-        img = Image.open(io.BytesIO(data))
-        try:
-            img_widget = ImageTk.PhotoImage(img)
-        except (RuntimeError, AttributeError):
-            print("Window closed, exiting.")
-            exit(0)
-        label.configure(image=img_widget)
-        label.image = img_widget
-
-
-t = Thread(target=daemon)
-t.start()
+def tk_sink(frame, img):
+    try:
+        img_widget = ImageTk.PhotoImage(img)
+    except (RuntimeError, AttributeError):
+        print("Window closed, exiting.")
+        return
+    label.configure(image=img_widget)
+    label.image = img_widget
+
+
+# Receiving, decoding and displaying run in separate stages so a slow decode never stalls the socket
+pipeline = LiveViewPipeline(receiver, [tk_sink]).start()
 
 root.mainloop()
 
-t.join()
+pipeline.stop()
+supervisor.stop()
+receiver.stop()
+print(pipeline.stats())
+print(supervisor.stats())
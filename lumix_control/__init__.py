@@ -1,2 +1,7 @@
 from .lumix_control import CameraControl
+from .group import CameraGroup
 
+try:
+    from .async_control import AsyncCameraControl
+except ImportError: # aiohttp is only needed for the asyncio client
+    pass
@@ -1,15 +1,49 @@
 import argparse
 from . import copy
+from . import mock_camera
+from . import bench
+from . import convert
+from . import timelapse
+from . import tether
 
-parser = argparse.ArgumentParser(description="Lumix Control")
-command = parser.add_subparsers(title="Command", dest="command")
-command.required = True
 
-copy_parser = command.add_parser("copy", help="Copy images from camera to computer")
-copy.make_parser(copy_parser)
+def main():
+    parser = argparse.ArgumentParser(description="Lumix Control")
+    command = parser.add_subparsers(title="Command", dest="command")
+    command.required = True
 
+    copy_parser = command.add_parser("copy", help="Copy images from camera to computer")
+    copy.make_parser(copy_parser)
 
-args = parser.parse_args()
-if args.command == "copy":
-    copy.main(args)
+    convert_parser = command.add_parser("convert", help="Convert raw files with darktable-cli")
+    convert.make_parser(convert_parser)
 
+    timelapse_parser = command.add_parser("timelapse", help="Capture frames at a fixed interval")
+    timelapse.make_parser(timelapse_parser)
+
+    tether_parser = command.add_parser("tether", help="Download new pictures as soon as they are taken")
+    tether.make_parser(tether_parser)
+
+    mock_parser = command.add_parser("mock", help="Run a mock camera for offline tests and benchmarks")
+    mock_camera.make_parser(mock_parser)
+
+    bench_parser = command.add_parser("bench", help="Benchmark copy, listing, control and live view against a mock camera")
+    bench.make_parser(bench_parser)
+
+    args = parser.parse_args()
+    if args.command == "copy":
+        copy.main(args)
+    elif args.command == "convert":
+        convert.main(args)
+    elif args.command == "timelapse":
+        timelapse.main(args)
+    elif args.command == "tether":
+        tether.main(args)
+    elif args.command == "mock":
+        mock_camera.main(args)
+    elif args.command == "bench":
+        bench.main(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import asyncio
+import os
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from . import content
+from . import responses
+from . import exposure
+from .lumix_control import BROWSE_REQUEST, claim_part, part_source, release_part
+
+
+class AsyncCameraControl:
+    # asyncio counterpart of CameraControl, so one event loop can drive several cameras.
+    # Commands return the same parsed replies as CameraControl.
+    #
+    #     async with AsyncCameraControl("192.168.54.1") as camera:
+    #         await camera.capture_photo()
+    def __init__(self, cam_ip, pool_size=4, timeout=5, soap_port=60606):
+        self.cam_ip = cam_ip
+        self.baseurl = "http://{ip}/cam.cgi".format(ip=self.cam_ip)
+        self.soap_url = "http://{host}:{port}/Server0/CDS_control".format(host=urlsplit(self.baseurl).hostname, port=soap_port)
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+        self.session = None
+        self.playmode = False
+        self.lens = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit_per_host=self.pool_size)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        await self.start_camera_control()
+
+    async def request(self, params, timeout=None):
+        kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+        async with self.session.get(self.baseurl, params=params, **kwargs) as resp:
+            return await resp.read()
+
+    async def command(self, params, parse=responses.parse_reply, timeout=None):
+        return parse(await self.request(params, timeout))
+
+    async def start_camera_control(self):
+        reply = await self.command({"mode": "camcmd", "value": "recmode"}, timeout=1)
+        if not self.check_response(reply):
+            print ("Error starting camera control")
+            raise Exception("Error starting camera control")
+        self.playmode = False
+
+    async def enter_playmode(self):
+        if self.playmode:
+            return True
+        reply = await self.command({"mode": "camcmd", "value": "playmode"})
+        if self.check_response(reply):
+            self.playmode = True
+        return self.playmode
+
+    async def start_stream(self, upd_port):
+        reply = await self.command({"mode": "startstream", "value": str(upd_port)})
+        reply_2 = await self.command({"mode": "setsetting", "type": "liveviewsize", "value": "vga"})
+        reply_3 = await self.command({"mode": "camcmd", "value": "recmode"})
+        self.playmode = False
+        if self.check_response(reply) and self.check_response(reply_2) and self.check_response(reply_3):
+            return True
+
+    async def stop_stream(self):
+        reply = await self.command({"mode": "stopstream"})
+        if self.check_response(reply):
+            return True
+
+    async def stream_frames(self, upd_port, host="0.0.0.0"):
+        # Yield the JPEG of every live view datagram received on upd_port
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=2)
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: LiveViewProtocol(queue), local_addr=(host, upd_port))
+        try:
+            await self.start_stream(upd_port)
+            while True:
+                yield await queue.get()
+        finally:
+            transport.close()
+
+    async def get_state(self):
+        return await self.command({"mode": "getstate"}, responses.parse_state)
+
+    async def get_info(self, setting, parse=responses.parse_reply):
+        return await self.command({"mode": "getinfo", "type": setting}, parse)
+
+    async def get_lens_info(self):
+        lens = await self.get_info("lens", responses.parse_lens_info)
+        self.lens = lens if lens.ok else None
+        return lens
+
+    async def lens_limits(self):
+        if self.lens is None:
+            await self.get_lens_info()
+        return self.lens
+
+    async def get_setting(self, setting):
+        return await self.command({"mode": "getsetting", "type": setting}, lambda data: responses.parse_setting(data, setting))
+
+    async def set_setting(self, settings):
+        params = {"mode": "setsetting"}
+        params.update(settings)
+        return await self.command(params)
+
+    async def set_iso(self, ISO):
+        stop = exposure.iso_stop(ISO)
+        reply = await self.set_setting({"type": "iso", "value": stop.value})
+        if self.check_response(reply):
+            print ("ISO set to " + stop.label)
+
+    async def set_focal(self, focal):
+        stop = exposure.aperture_stop(focal, await self.lens_limits())
+        reply = await self.set_setting({"type": "focal", "value": stop.value})
+        if self.check_response(reply):
+            print ("F Stop set to " + stop.label)
+
+    async def set_shutter(self, shutter):
+        stop = exposure.shutter_stop(shutter, await self.lens_limits())
+        reply = await self.set_setting({"type": "shtrspeed", "value": stop.value})
+        if self.check_response(reply):
+            print ("Shutter set to " + stop.label)
+
+    async def set_video_quality(self, quality="mp4ed_30p_100mbps_4k"):
+        reply = await self.set_setting({"type": "videoquality", "value": quality})
+        if self.check_response(reply):
+            print ("Video quality set to " + quality)
+        return reply
+
+    async def focus_control(self, direction="tele", speed="normal"):
+        return await self.command({"mode": "camctrl", "type": "focus", "value": "{0}-{1}".format(direction, speed)}, responses.parse_focus_position)
+
+    async def capture_photo(self):
+        return await self.command({"mode": "camcmd", "value": "capture"})
+
+    async def video_record_start(self):
+        return await self.command({"mode": "camcmd", "value": "video_recstart"})
+
+    async def video_record_stop(self):
+        return await self.command({"mode": "camcmd", "value": "video_recstop"})
+
+    async def get_content_count(self):
+        return content.parse_content_count(await self.request({"mode": "get_content_info"}))
+
+    async def iter_pictures(self, batch_size=500, start=0):
+        await self.enter_playmode()
+        num_pics = await self.get_content_count()
+        while start < num_pics:
+            page = await self.browse(start, min(batch_size, num_pics - start))
+            if page.number_returned == 0:
+                break
+            start += page.number_returned
+            num_pics = min(num_pics, page.total_matches or num_pics)
+            for entry in content.iter_didl(page.didl):
+                yield entry
+
+    async def get_pictures(self):
+        return [entry async for entry in self.iter_pictures()]
+
+    async def get_picture_urls(self):
+        return [entry.url async for entry in self.iter_pictures()]
+
+    async def browse(self, start, count):
+        soap_headers = {
+            'Content-Type': 'text/xml; charset="UTF-8"',
+            'SOAPACTION': 'urn:schemas-upnp-org:service:ContentDirectory:1#Browse',
+        }
+        parser = content.BrowseResponseParser()
+        async with self.session.post(self.soap_url, data=(BROWSE_REQUEST % (start, count)).encode(), headers=soap_headers) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(1024 * 64):
+                parser.feed(chunk)
+        return parser.close()
+
+    async def download_picture(self, url, dest, size=None, chunk_size=1024 * 256, retries=3, date=None):
+        # Same .part/Range resume logic as CameraControl.download_picture
+        await self.enter_playmode()
+        if size is None:
+            size = await self.get_remote_size(url)
+        part = dest + ".part"
+        claim_part(part, part_source(url, size, date))
+        for attempt in range(retries + 1):
+            offset = os.path.getsize(part) if os.path.isfile(part) else 0
+            if offset > size:
+                os.remove(part)
+                offset = 0
+            if offset < size or not os.path.isfile(part):
+                try:
+                    await self.download_range(url, part, offset, chunk_size)
+                except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError):
+                    if attempt == retries:
+                        raise
+                    continue
+            if os.path.getsize(part) == size:
+                os.replace(part, dest)
+                release_part(part)
+                return
+            if os.path.getsize(part) > size:
+                os.remove(part)
+        raise Exception("Downloaded size of {url} does not match the camera's X-FILE_SIZE".format(url=url))
+
+    async def download_range(self, url, part, offset, chunk_size):
+        headers = {"Range": "bytes={0}-".format(offset)} if offset else {}
+        async with self.session.get(url, headers=headers) as resp:
+            resp.raise_for_status()
+            if offset and resp.status != 206:
+                offset = 0
+            # File writes are small compared to the network round trips, keep them inline
+            with open(part, "ab" if offset else "wb") as f:
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    f.write(chunk)
+
+    async def get_remote_size(self, url):
+        async with self.session.head(url) as head:
+            return int(head.headers["X-FILE_SIZE"])
+
+    def check_response(self, reply):
+        # The camera answers 200 even on error, the parsed <result> tells
+        if reply.ok:
+            return True
+        else:
+            print (reply.text)
+            return False
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class LiveViewProtocol(asyncio.DatagramProtocol):
+    def __init__(self, queue):
+        self.queue = queue
+
+    def datagram_received(self, data, addr):
+        start = data.find(b'\xff\xd8')
+        if start < 0 or data[-2:] != b'\xff\xd9':
+            return
+        if self.queue.full():
+            # Drop the oldest frame rather than fall behind
+            self.queue.get_nowait()
+        self.queue.put_nowait(data[start:])
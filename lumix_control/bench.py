@@ -0,0 +1,371 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from . import colors
+from . import responses
+from .content import ContentEntry
+from .copy import copy_files, iter_filter_files
+from .copy.index import TransferIndex
+from .lumix_control import CameraControl
+from .mock_camera import MockCamera, frame_send_time
+
+KB = 1024
+MB = 1024 * KB
+
+# (relative frequency, min size, max size) per file kind, like mock_camera.DEFAULT_FILE_MIX
+# but small enough to run in seconds
+FILE_MIXES = {
+    "small": {"JPG": (1, 100 * KB, 300 * KB)},
+    "mixed": {"JPG": (6, 1 * MB, 2 * MB), "RAW": (3, 4 * MB, 5 * MB), "MP4": (1, 16 * MB, 24 * MB)},
+    "large": {"MP4": (1, 48 * MB, 64 * MB)},
+}
+SUITES = ["copy_wifi", "copy_usb", "listing", "previews", "control", "parse", "filter", "live_view"]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def timing_summary(durations):
+    return {
+        "count": len(durations),
+        "mean_ms": statistics.mean(durations) * 1000,
+        "p50_ms": percentile(durations, 0.5) * 1000,
+        "p95_ms": percentile(durations, 0.95) * 1000,
+        "max_ms": max(durations) * 1000,
+    }
+
+
+def copy_args(output, conn_type):
+    return argparse.Namespace(extension="all", output=output, conn_type=conn_type, if_exists="rename")
+
+
+def copy_modes(options):
+    # (jobs, verify) pairs, verification is only benchmarked when asked for
+    return [(jobs, verify) for jobs in options.jobs for verify in ([False, True] if options.verify else [False])]
+
+
+def throughput(files, size, duration):
+    return {"files": files, "bytes": size, "seconds": duration, "files_per_s": files / duration, "mb_per_s": size / MB / duration}
+
+
+def bench_copy_wifi(options):
+    from .copy import wifi
+    results = []
+    for mix in options.mixes:
+        for jobs, verify in copy_modes(options):
+            with MockCamera(card_size=options.files, file_mix=FILE_MIXES[mix], latency=options.latency, bandwidth=options.bandwidth) as mock:
+                output = tempfile.mkdtemp(prefix="lumix-bench-")
+                try:
+                    started = time.perf_counter()
+                    wifi.start_connection(mock.cam_ip, jobs, mock.soap_port)
+                    files = iter_filter_files(wifi.list_files(options.batch_size), copy_args(output, "wifi"), lambda text: None,
+                                              wifi.get_file_size, wifi.get_file_mtime, wifi.get_dest_name)
+                    copied = size = 0
+                    for _, _, file_size, _ in copy_files(files, wifi.copy_file, wifi.get_file_size, jobs, verify):
+                        copied += 1
+                        size += file_size
+                    duration = time.perf_counter() - started
+                    wifi.end_connection()
+                finally:
+                    shutil.rmtree(output)
+            results.append({"suite": "copy_wifi", "params": {"mix": mix, "jobs": jobs, "verify": verify, "files": options.files}, **throughput(copied, size, duration)})
+    return results
+
+
+def bench_previews(options):
+    # Thumbnail sync of a whole card, next to copying the originals of the same card
+    from .copy import wifi, sync_previews
+    results = []
+    for card_size in options.card_sizes:
+        for jobs in options.jobs:
+            with MockCamera(card_size=card_size, latency=options.latency, bandwidth=options.bandwidth) as mock:
+                output = tempfile.mkdtemp(prefix="lumix-bench-")
+                try:
+                    wifi.start_connection(mock.cam_ip, jobs, mock.soap_port)
+                    args = argparse.Namespace(previews=output, preview_size="thumbnail", batch_size=options.batch_size, jobs=jobs)
+                    started = time.perf_counter()
+                    fetched, _, size = sync_previews(args, lambda text: None)
+                    duration = time.perf_counter() - started
+                    wifi.end_connection()
+                finally:
+                    shutil.rmtree(output)
+            results.append({"suite": "previews", "params": {"card_size": card_size, "jobs": jobs}, **throughput(fetched, size, duration)})
+    return results
+
+
+def make_source_tree(root, files, mix, seed=0):
+    # Fake DCIM tree with the same layout as the card: DCIM/100_PANA/P1000001.JPG
+    import random
+    generator = random.Random(seed)
+    block = os.urandom(MB)
+    kinds = list(mix)
+    for i in range(files):
+        kind = generator.choices(kinds, weights=[mix[k][0] for k in kinds])[0]
+        size = generator.randint(mix[kind][1], mix[kind][2])
+        directory = os.path.join(root, "{0}_PANA".format(100 + i // 999))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "P{0:07d}.{1}".format(1000000 + i, "RW2" if kind == "RAW" else kind)), "wb") as f:
+            for offset in range(0, size, MB):
+                f.write(block[:min(MB, size - offset)])
+
+
+def bench_copy_usb(options):
+    from .copy import usb
+    results = []
+    for mix in options.mixes:
+        source = tempfile.mkdtemp(prefix="lumix-bench-card-")
+        try:
+            make_source_tree(source, options.files, FILE_MIXES[mix])
+            for jobs, verify in copy_modes(options):
+                output = tempfile.mkdtemp(prefix="lumix-bench-")
+                try:
+                    started = time.perf_counter()
+                    files = iter_filter_files(usb.list_files(None, source), copy_args(output, "usb"), lambda text: None,
+                                              usb.get_file_size, usb.get_file_mtime, usb.get_dest_name)
+                    copied = size = 0
+                    for _, _, file_size, _ in copy_files(files, usb.copy_file, usb.get_file_size, jobs, verify):
+                        copied += 1
+                        size += file_size
+                    duration = time.perf_counter() - started
+                finally:
+                    shutil.rmtree(output)
+                # The source was just written, so this measures the page cache rather than a card reader
+                results.append({"suite": "copy_usb", "params": {"mix": mix, "jobs": jobs, "verify": verify, "files": options.files}, **throughput(copied, size, duration)})
+        finally:
+            shutil.rmtree(source)
+    return results
+
+
+def bench_listing(options):
+    results = []
+    for card_size in options.card_sizes:
+        with MockCamera(card_size=card_size, latency=options.latency) as mock:
+            camera = CameraControl(mock.cam_ip, soap_port=mock.soap_port)
+            durations = []
+            first_entry = []
+            for _ in range(options.repeat):
+                started = time.perf_counter()
+                entries = camera.iter_pictures(options.batch_size)
+                next(entries)
+                first_entry.append(time.perf_counter() - started)
+                count = 1 + sum(1 for _ in entries)
+                durations.append(time.perf_counter() - started)
+            camera.close()
+        results.append({
+            "suite": "listing",
+            "params": {"card_size": card_size, "batch_size": options.batch_size},
+            "entries": count,
+            "total": timing_summary(durations),
+            "first_entry": timing_summary(first_entry),
+        })
+    return results
+
+
+def bench_control(options):
+    commands = {
+        "getstate": lambda camera, i: camera.get_state(),
+        # Bypass the settings cache, this measures the round trip
+        "getsetting": lambda camera, i: camera.command({"mode": "getsetting", "type": "iso"}, lambda data: responses.parse_setting(data, "iso")),
+        "setsetting": lambda camera, i: camera.command({"mode": "setsetting", "type": "iso", "value": str(100 + i % 2 * 100)}),
+        "capture": lambda camera, i: camera.capture_photo(),
+        "focus": lambda camera, i: camera.focus_control("wide" if i % 2 else "tele", "normal"),
+    }
+    results = []
+    with MockCamera(card_size=0, latency=options.latency) as mock:
+        camera = CameraControl(mock.cam_ip, soap_port=mock.soap_port)
+        for name, command in commands.items():
+            durations = []
+            for i in range(options.commands):
+                started = time.perf_counter()
+                command(camera, i)
+                durations.append(time.perf_counter() - started)
+            results.append({"suite": "control", "params": {"command": name, "latency": options.latency}, **timing_summary(durations)})
+        camera.close()
+    return results
+
+
+def bench_parse(options):
+    # Cost of turning each kind of reply into its typed object, next to the
+    # substring check / ElementTree / split parsing it replaced
+    import xml.etree.ElementTree as ET
+    with MockCamera(card_size=0) as mock:
+        replies = {
+            "camcmd": (mock.command({"mode": "camcmd", "value": "recmode"}, None), responses.parse_reply,
+                       lambda text: "<result>ok</result>" in text),
+            "getstate": (mock.command({"mode": "getstate"}, None), responses.parse_state,
+                         lambda text: [(element.tag, element.text) for element in ET.fromstring(text).iter() if not len(element)]),
+            "getsetting": (mock.command({"mode": "getsetting", "type": "iso"}, None), lambda data: responses.parse_setting(data, "iso"),
+                           lambda text: ET.fromstring(text).find("settingvalue").get("iso")),
+            "lens": (mock.command({"mode": "getinfo", "type": "lens"}, None), responses.parse_lens_info,
+                     lambda text: text.split(",")),
+            "focus": (mock.command({"mode": "camctrl", "type": "focus", "value": "tele-normal"}, None), responses.parse_focus_position,
+                      lambda text: int(text.split(",")[1])),
+        }
+    results = []
+    repeat = max(options.commands, 1) * 100
+    for name, (text, parse, baseline) in replies.items():
+        data = text.encode()
+        timings = {}
+        for label, function, argument in (("typed_us", parse, data), ("baseline_us", baseline, text)):
+            started = time.perf_counter()
+            for _ in range(repeat):
+                function(argument)
+            timings[label] = (time.perf_counter() - started) / repeat * 1e6
+        results.append({"suite": "parse", "params": {"reply": name, "bytes": len(data)}, "count": repeat, **timings})
+    return results
+
+
+def bench_filter(options):
+    results = []
+    for existing in options.existing:
+        output = tempfile.mkdtemp(prefix="lumix-bench-")
+        try:
+            entries = []
+            for i in range(existing):
+                name = "P{0:07d}.JPG".format(1000000 + i)
+                with open(os.path.join(output, name), "wb") as f:
+                    f.truncate(i)
+                entries.append(ContentEntry("http://camera/DO{0:07d}.JPG".format(1000000 + i), size=i, date=str(i)))
+            args = copy_args(output, "wifi")
+            get_size = lambda entry: entry.size
+            get_name = lambda entry: entry.local_name
+            get_key = lambda entry: entry.index_key()
+            for use_index in (False, True):
+                index = TransferIndex(output) if use_index else None
+                if index is not None and not len(index):
+                    # First run fills the index, the timed run below uses it
+                    for _ in iter_filter_files(entries, args, lambda text: None, get_size, lambda entry: None, get_name, index, get_key):
+                        pass
+                started = time.perf_counter()
+                remaining = sum(1 for _ in iter_filter_files(entries, args, lambda text: None, get_size, lambda entry: None, get_name, index, get_key))
+                duration = time.perf_counter() - started
+                if index is not None:
+                    index.close()
+                results.append({
+                    "suite": "filter",
+                    "params": {"existing": existing, "index": use_index},
+                    "remaining": remaining,
+                    "seconds": duration,
+                    "us_per_file": duration / max(existing, 1) * 1e6,
+                })
+        finally:
+            shutil.rmtree(output)
+    return results
+
+
+def bench_live_view(options):
+    from .live_view import LiveViewPipeline, LiveViewReceiver, decode_jpeg
+    decoder = decode_jpeg if importlib.util.find_spec("PIL") is not None else None
+    latencies = []
+
+    def sink(frame, image):
+        sent = frame_send_time(frame.data)
+        if sent is not None:
+            latencies.append(time.monotonic() - sent)
+
+    with MockCamera(card_size=0, fps=options.fps, packet_loss=options.packet_loss) as mock:
+        camera = CameraControl(mock.cam_ip, soap_port=mock.soap_port)
+        receiver = LiveViewReceiver(options.stream_port, "127.0.0.1").start()
+        pipeline = LiveViewPipeline(receiver, [sink], decoder=decoder).start()
+        camera.start_stream(options.stream_port)
+        time.sleep(options.duration)
+        camera.stop_stream()
+        pipeline.stop()
+        receiver.stop()
+        camera.close()
+    result = {
+        "suite": "live_view",
+        "params": {"fps": options.fps, "packet_loss": options.packet_loss, "decoder": decoder is not None, "seconds": options.duration},
+        "frames": len(latencies),
+        "fps": len(latencies) / options.duration,
+        "receiver": receiver.stats(),
+        "pipeline": pipeline.stats(),
+    }
+    if latencies:
+        result["latency"] = timing_summary(latencies)
+    return [result]
+
+
+BENCHMARKS = {
+    "copy_wifi": bench_copy_wifi,
+    "copy_usb": bench_copy_usb,
+    "listing": bench_listing,
+    "previews": bench_previews,
+    "control": bench_control,
+    "parse": bench_parse,
+    "filter": bench_filter,
+    "live_view": bench_live_view,
+}
+
+
+def int_list(text):
+    return [int(value) for value in text.split(",")]
+
+
+def make_parser(bench_parser: argparse.ArgumentParser):
+    bench_parser.add_argument('-v', '--verbose', action='store_true', help='Print progress')
+    bench_parser.add_argument('-o', '--output', help='Write the JSON results to this file instead of stdout', type=str)
+    bench_parser.add_argument('-s', '--suite', help='Benchmarks to run', choices=SUITES, action='append', dest='suites')
+    bench_parser.add_argument('--files', help='Number of files to copy', default=30, type=int)
+    bench_parser.add_argument('--mixes', help='File size mixes to copy', default=list(FILE_MIXES), type=lambda text: text.split(","))
+    bench_parser.add_argument('--jobs', help='Comma separated numbers of copy jobs', default=[1, 4], type=int_list)
+    bench_parser.add_argument('--verify', help='Also run the copy benchmarks with verification', action='store_true')
+    bench_parser.add_argument('--batch-size', help='ContentDirectory page size', default=500, type=int)
+    bench_parser.add_argument('--card-sizes', help='Comma separated card sizes for the listing benchmark', default=[100, 1000, 5000], type=int_list)
+    bench_parser.add_argument('--existing', help='Comma separated output directory sizes for the filter benchmark', default=[100, 2000], type=int_list)
+    bench_parser.add_argument('--commands', help='Repetitions of each control command', default=50, type=int)
+    bench_parser.add_argument('--repeat', help='Repetitions of each listing', default=3, type=int)
+    bench_parser.add_argument('--latency', help='Latency added by the mock camera, in seconds', default=0.0, type=float)
+    bench_parser.add_argument('--bandwidth', help='Mock camera download bandwidth in bytes per second', default=None, type=float)
+    bench_parser.add_argument('--fps', help='Mock live view frame rate', default=30, type=int)
+    bench_parser.add_argument('--packet-loss', help='Mock live view datagram loss probability', default=0.0, type=float)
+    bench_parser.add_argument('--duration', help='Live view benchmark duration in seconds', default=3.0, type=float)
+    bench_parser.add_argument('--stream-port', help='Local UDP port for the live view benchmark', default=49199, type=int)
+
+
+def main(args):
+    colors.verbose = args.verbose
+    results = []
+    for suite in args.suites or SUITES:
+        if args.verbose:
+            # stdout carries the JSON report
+            colors.pprint(f'Running {suite} benchmark', colors.LIGHT_GRAY, file=sys.stderr)
+        # Keep the copy backends quiet, their debug output would be part of the measurement
+        verbose, colors.verbose = colors.verbose, False
+        try:
+            results.extend(BENCHMARKS[suite](args))
+        finally:
+            colors.verbose = verbose
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("command", "output")},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        colors.success(f'Wrote {len(results)} results to {args.output}')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lumix Control benchmarks")
+    make_parser(parser)
+    main(parser.parse_args())
@@ -25,8 +25,8 @@ END = "\033[0m"
 
 verbose = True
 
-def pprint(text, color, end = "\n"):
-    print(color + text + END, end = end)
+def pprint(text, color, end = "\n", file = None):
+    print(color + text + END, end = end, file = file)
 
 def error(text):
     pprint(text, LIGHT_RED)
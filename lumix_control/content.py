@@ -0,0 +1,144 @@
+import xml.etree.ElementTree as ET
+
+
+class ContentEntry:
+    # One <res> element of a DIDL-Lite item: the camera lists the original file,
+    # a large preview and a thumbnail as separate resources of the same item.
+    __slots__ = ("url", "size", "date", "mime_type", "object_id")
+
+    def __init__(self, url, size=None, date=None, mime_type=None, object_id=None):
+        self.url = url
+        self.size = size
+        self.date = date
+        self.mime_type = mime_type
+        self.object_id = object_id
+
+    @property
+    def name(self):
+        return self.url.split("/")[-1]
+
+    @property
+    def local_name(self):
+        # Name of the original once copied: DO1000123.JPG -> P1000123.JPG, .RAW -> .RW2
+        return self.name.replace("DO", "P").replace(".RAW", ".RW2")
+
+    def index_key(self, size=None):
+        # Identifies the camera file in the transfer index, for `copy wifi` and `tether` alike
+        return (self.name, self.size if size is None else size, self.date or "")
+
+    def __str__(self):
+        return self.url
+
+    def __repr__(self):
+        return "ContentEntry({0!r}, size={1!r}, date={2!r}, mime_type={3!r})".format(self.url, self.size, self.date, self.mime_type)
+
+
+class BrowsePage:
+    __slots__ = ("didl", "number_returned", "total_matches")
+
+    def __init__(self, didl, number_returned, total_matches):
+        self.didl = didl
+        self.number_returned = number_returned
+        self.total_matches = total_matches
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def mime_type_from_protocol_info(protocol_info):
+    # protocolInfo looks like "http-get:*:image/jpeg:DLNA.ORG_PN=JPEG_LRG"
+    parts = protocol_info.split(":")
+    if len(parts) < 3 or parts[2] == "*":
+        return None
+    return parts[2]
+
+
+def iter_didl(didl, chunk_size=1024 * 16):
+    # The DIDL is fed in slices and the events drained after each one, so an item is
+    # yielded as soon as its closing tag is parsed and then cleared: only the (emptied)
+    # items seen so far are kept, not the whole document tree.
+    parser = ET.XMLPullParser(events=("end",))
+    for start in range(0, len(didl), chunk_size):
+        parser.feed(didl[start:start + chunk_size])
+        yield from iter_didl_events(parser)
+    parser.close()
+    yield from iter_didl_events(parser)
+
+
+def iter_didl_events(parser):
+    for _, element in parser.read_events():
+        if local_name(element.tag) != "item":
+            continue
+        date = None
+        resources = []
+        for child in element:
+            name = local_name(child.tag)
+            if name == "date":
+                date = child.text
+            elif name == "res" and child.text:
+                resources.append(child)
+        for res in resources:
+            size = res.get("size")
+            yield ContentEntry(
+                res.text.strip(),
+                size=int(size) if size else None,
+                date=date,
+                mime_type=mime_type_from_protocol_info(res.get("protocolInfo", "")),
+                object_id=element.get("id"),
+            )
+        element.clear()
+
+
+def parse_didl(didl):
+    return list(iter_didl(didl))
+
+
+class BrowseResponseParser:
+    # Incremental parser for a SOAP BrowseResponse: feed() it chunks as they
+    # arrive from the socket, then close() returns the BrowsePage.
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=("end",))
+        self.didl = None
+        self.number_returned = 0
+        self.total_matches = 0
+
+    def feed(self, chunk):
+        self.parser.feed(chunk)
+        self.read_events()
+
+    def close(self):
+        self.parser.close()
+        self.read_events()
+        if self.didl is None:
+            raise Exception("No Result in Browse response")
+        return BrowsePage(self.didl, self.number_returned, self.total_matches)
+
+    def read_events(self):
+        for _, element in self.parser.read_events():
+            name = local_name(element.tag)
+            if name == "Result":
+                self.didl = element.text or ""
+            elif name == "NumberReturned":
+                self.number_returned = int(element.text)
+            elif name == "TotalMatches":
+                self.total_matches = int(element.text)
+            else:
+                continue
+            element.clear()
+
+
+def parse_browse_response(stream, chunk_size=1024 * 64):
+    # Parse a SOAP BrowseResponse while it is being read from the socket
+    parser = BrowseResponseParser()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return parser.close()
+        parser.feed(chunk)
+
+
+def parse_content_count(text):
+    # Reply to mode=get_content_info
+    element = ET.fromstring(text).find(".//total_content_number")
+    return int(element.text)
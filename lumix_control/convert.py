@@ -0,0 +1,160 @@
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import colors
+
+# GX80 raw files are .RAW on the camera and renamed to .RW2 by `copy wifi`
+RAW_EXTENSIONS = (".raw", ".rw2")
+
+
+def available_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def is_raw(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in RAW_EXTENSIONS
+
+
+def output_path(input_file: str, output_dir: str, format: str = "png") -> str:
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(input_file))[0] + "." + format)
+
+
+def up_to_date(input_file: str, output_file: str) -> bool:
+    try:
+        return os.path.getmtime(output_file) >= os.path.getmtime(input_file)
+    except FileNotFoundError:
+        return False
+
+
+def list_raw_files(inputs):
+    # Files are taken as they are, directories are searched (not recursively) for raw files
+    for path in inputs:
+        if os.path.isdir(path):
+            for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+                if entry.is_file() and is_raw(entry.name):
+                    yield entry.path
+        else:
+            yield path
+
+
+class Converter:
+    # Runs darktable-cli conversions, `jobs` at a time.
+    # Every worker thread drives one darktable-cli process with its own config
+    # directory: darktable locks its databases, so instances can't share the user's.
+    def __init__(self, output_dir: str, jobs: int = 0, format: str = "png", force: bool = False, command: str = "darktable-cli"):
+        self.output_dir = output_dir
+        self.jobs = jobs or available_cores()
+        self.format = format
+        self.force = force
+        self.command = command
+        # darktable is multithreaded itself, split the cores between the instances
+        self.env = dict(os.environ, OMP_NUM_THREADS=str(max(available_cores() // self.jobs, 1)))
+        self.local = threading.local()
+        self.config_dirs = []
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+        os.makedirs(output_dir, exist_ok=True)
+
+    def config_dir(self) -> str:
+        if not hasattr(self.local, "config_dir"):
+            self.local.config_dir = tempfile.mkdtemp(prefix="lumix-darktable-")
+            with self.lock:
+                self.config_dirs.append(self.local.config_dir)
+        return self.local.config_dir
+
+    def submit(self, input_file: str):
+        # Returns a future of (input file, output file, seconds), or None if the output is up to date
+        output_file = output_path(input_file, self.output_dir, self.format)
+        if not self.force and up_to_date(input_file, output_file):
+            return None
+        return self.executor.submit(self.convert, input_file, output_file)
+
+    def convert(self, input_file: str, output_file: str):
+        # Write to a temporary name first: darktable-cli never overwrites (it picks
+        # another name instead), and a half written output must not look up to date
+        directory, name = os.path.split(output_file)
+        temporary = os.path.join(directory, ".converting-" + name)
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        started = time.monotonic()
+        result = subprocess.run(
+            [self.command, input_file, temporary, "--core", "--configdir", self.config_dir(), "--library", ":memory:"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=self.env,
+        )
+        duration = time.monotonic() - started
+        if result.returncode != 0 or not os.path.isfile(temporary):
+            message = result.stderr.decode(errors="replace").strip().splitlines()
+            raise Exception("{command} failed on {input_file}: {message}".format(
+                command=self.command, input_file=input_file, message=message[-1] if message else "exit status " + str(result.returncode)))
+        os.replace(temporary, output_file)
+        return input_file, output_file, duration
+
+    def close(self):
+        self.executor.shutdown()
+        for config_dir in self.config_dirs:
+            shutil.rmtree(config_dir, ignore_errors=True)
+
+
+def report(futures, total=None):
+    # Print per-file timings as conversions finish. Returns (converted, failed, busy seconds).
+    converted = failed = 0
+    busy = 0.0
+    for future in as_completed(futures):
+        try:
+            input_file, output_file, duration = future.result()
+        except Exception as e:
+            failed += 1
+            colors.error(str(e))
+            continue
+        converted += 1
+        busy += duration
+        progress = f"{converted}/{total}" if total else str(converted)
+        print(f"Converted {os.path.basename(input_file)} to {os.path.basename(output_file)} in {duration:.1f}s ({progress})")
+    return converted, failed, busy
+
+
+def make_parser(convert_parser: argparse.ArgumentParser):
+    convert_parser.add_argument('inputs', help='Raw files or directories containing them', nargs='+', metavar='INPUT')
+    convert_parser.add_argument('-v', '--verbose', action='store_true', help='Print verbose output')
+    convert_parser.add_argument('-o', '--output', help='Output directory', required=True, type=str)
+    convert_parser.add_argument('-j', '--jobs', help='Number of conversions at once (default: number of cores)', type=int, default=0)
+    convert_parser.add_argument('-f', '--format', help='Output format, as a file extension darktable-cli understands', default='png', type=str)
+    convert_parser.add_argument('--force', help='Convert files even if the output is newer than the raw file', action='store_true')
+    convert_parser.add_argument('--darktable-cli', help='darktable-cli executable', default='darktable-cli', type=str, dest='darktable_cli')
+
+
+def main(args):
+    colors.verbose = args.verbose
+    debug = colors.debug
+    if shutil.which(args.darktable_cli) is None:
+        colors.error(f'{args.darktable_cli} not found, install darktable to convert raw files')
+        exit(1)
+    converter = Converter(args.output, args.jobs, args.format, args.force, args.darktable_cli)
+    debug(f'Converting with {converter.jobs} jobs')
+    started = time.monotonic()
+    futures = []
+    skipped = 0
+    try:
+        for input_file in list_raw_files(args.inputs):
+            future = converter.submit(input_file)
+            if future is None:
+                debug(f'Skipping {input_file} because its output is up to date')
+                skipped += 1
+            else:
+                futures.append(future)
+        converted, failed, busy = report(futures, len(futures))
+    finally:
+        converter.close()
+    elapsed = time.monotonic() - started
+    print(f'Converted {converted} files in {elapsed:.1f}s ({busy / max(elapsed, 1e-9):.1f}x parallel), skipped {skipped} up to date')
+    if failed:
+        colors.error(f'{failed} conversions failed')
+        exit(1)
@@ -1,6 +1,12 @@
 import argparse
 import subprocess
 from ..copy.regex import file_type_match
+from ..copy.index import TransferIndex
+from ..copy.verify import Manifest
+from ..copy.preview import PreviewCache, load_selection, is_selected
+from ..convert import Converter, available_cores, is_raw, report as convert_report
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import shutil
 import os
 
@@ -13,52 +19,191 @@ def make_parser(copy_parser: argparse.ArgumentParser):
     # Arguments for both wifi and usb
     add_args = lambda *args, **kwargs: wifi.add_argument(*args, **kwargs) and usb.add_argument(*args, **kwargs)
     add_args('-v', '--verbose', action='store_true', help='Print verbose output')
-    add_args("-o", "--output", help="Output directory", required=True, type=str)
     add_args("-e", "--extension", help="File extension to copy", choices=['jpg', 'raw', 'image', 'mp4', 'all'], default='all', type=str)
     add_args("-x", "--if-exists", help="What to do if file already exists", choices=['skip', 'overwrite', 'rename'], default='rename', type=str)
+    add_args("--no-index", help="Ignore the index of already imported files and compare with the output directory instead", action='store_true')
+    add_args("--select", help="Only copy these items: a preview directory (the items whose previews were kept) or a file listing names or content IDs", type=str, metavar='PATH')
+    add_args("--convert", help="Convert raw files with darktable-cli into this directory as soon as they are copied", type=str, metavar='DIRECTORY')
+    add_args("--verify", help="Hash files while copying, check them against a second read of the card (usb) and record the digests in the output directory", action='store_true')
 
     # Arguments for wifi only
+    wifi.add_argument("-o", "--output", help="Output directory (not needed with --previews)", type=str)
     wifi.add_argument('-i', '--ip', help='IP address of camera', type=str, metavar='IP', dest='ip', default="192.168.54.1")
+    wifi.add_argument('-j', '--jobs', help='Number of files to download at once', type=int, default=4)
+    wifi.add_argument('--soap-port', help='Port of the camera\'s ContentDirectory service', type=int, default=60606)
+    wifi.add_argument('-b', '--batch-size', help='Number of items to request per ContentDirectory page', type=int, default=500)
+    wifi.add_argument('--previews', help='Only download the camera\'s previews of every item into this directory, to pick the originals to copy with --select', type=str, metavar='DIRECTORY')
+    wifi.add_argument('--preview-size', help='Preview rendition to download', choices=['thumbnail', 'large'], default='thumbnail')
+
+    # Arguments for usb only
+    usb.add_argument("-o", "--output", help="Output directory", required=True, type=str)
+    usb.add_argument('-j', '--jobs', help='Number of files to copy at once (default: based on the source and destination disks)', type=int, default=0)
+    usb.add_argument('--buffer-size', help='Copy buffer size in MiB', type=int, default=8)
+    usb.set_defaults(batch_size=None, soap_port=None, previews=None)
 
 
 def main(args):
     if args.conn_type == 'wifi':
-        from ..copy.wifi import start_connection, list_files, colors, copy_file, get_file_size, get_file_mtime, end_connection, get_dest_name
+        from ..copy.wifi import start_connection, list_files, colors, copy_file, get_file_size, get_file_mtime, end_connection, get_dest_name, get_file_key
     else:
-        from ..copy.usb import start_connection, list_files, colors, copy_file, get_file_size, get_file_mtime, end_connection, get_dest_name
+        from ..copy.usb import start_connection, list_files, colors, copy_file, get_file_size, get_file_mtime, end_connection, get_dest_name, get_file_key
 
     colors.verbose = args.verbose
     debug = colors.debug
+    if not args.output and not args.previews:
+        colors.error('An output directory is required, use -o')
+        exit(1)
 
     debug('Starting connection')
-    start_connection(args.ip if args.conn_type == 'wifi' else "")
+    start_connection(args.ip if args.conn_type == 'wifi' else "", args.jobs, args.soap_port)
     debug('Connection started')
 
+    if not args.previews and not os.path.isdir(args.output):
+        debug(f'Output directory does not exist, creating it')
+        os.makedirs(args.output)
+    if args.conn_type == 'usb':
+        from ..copy import usb
+        usb.buffer_size = args.buffer_size * 1024 * 1024
+        if not args.jobs:
+            args.jobs = usb.suggest_jobs(usb.GX80_DCIM_PATH, args.output)
+
+    if args.previews:
+        fetched, cached, size = sync_previews(args, debug)
+        end_connection()
+        print(f'Fetched {fetched} previews ({human_readable_size(size)}), {cached} in {args.previews}')
+        print(f'Delete the previews of the shots you don\'t want, then copy the rest with --select {args.previews}')
+        return
+
+    # Listing, filtering and copying are chained generators, so copying starts
+    # as soon as the first files are known.
     debug('Listing files on camera')
-    files = list_files()
-    debug(f'Found {len(files)} files')
+    files = list_files(args.batch_size)
+    if args.select:
+        selection = load_selection(args.select)
+        debug(f'Copying only the {len(selection)} selected items')
+        files = (file for file in files if is_selected(selection, file, get_dest_name(file)))
 
     debug('Filtering files using regexp')
-    files = filter_files(files, args, debug, get_file_size, get_file_mtime, get_dest_name)
-    debug(f'Found {len(files)} files')
-    
-    debug('Copying files')
+    index = None if args.no_index else TransferIndex(args.output)
+    if index is not None:
+        debug(f'Loaded {len(index)} already imported files from the index')
+    files = iter_filter_files(files, args, debug, get_file_size, get_file_mtime, get_dest_name, index, get_file_key)
+
+    manifest = Manifest(args.output) if args.verify else None
+    converter = None
+    conversions = []
+    if args.convert:
+        if shutil.which('darktable-cli') is None:
+            colors.error('darktable-cli not found, install darktable to use --convert')
+            exit(1)
+        # Conversions share the machine with the copy, leave a core for it
+        converter = Converter(args.convert, max(available_cores() - 1, 1))
+
+    debug(f'Copying files using {args.jobs} jobs')
     total_size = 0
-    for i, (file, output_file) in enumerate(files):
-        file_size = get_file_size(file)
-        total_size += file_size
-        if not args.verbose:
-            print("\33[2K\r", end='')
-            print(f'\rCopying {output_file.split("/")[-1]} ({i}/{len(files)}) ({human_readable_size(file_size)}) ', end='')
-        debug(f'Copying {file} to {output_file}')
-        copy_file(file, output_file)
+    copied = 0
+    corrupted = []
+    try:
+        for file, output_file, file_size, checksum in copy_files(files, copy_file, get_file_size, args.jobs, args.verify):
+            if checksum is not None:
+                digest, source_digest = checksum
+                if source_digest is not None and digest != source_digest:
+                    # Remove it so the next run copies it again instead of seeing a complete file
+                    colors.error(f'\n{file} changed between two reads of the card, removing the copy {output_file}')
+                    os.remove(output_file)
+                    corrupted.append(file)
+                    continue
+                manifest.add(output_file, digest)
+            total_size += file_size
+            copied += 1
+            if index is not None:
+                index.add(get_file_key(file), output_file)
+            if converter is not None and is_raw(output_file):
+                future = converter.submit(output_file)
+                if future is not None:
+                    conversions.append(future)
+            if not args.verbose:
+                print("\33[2K\r", end='')
+                print(f'\rCopied {output_file.split("/")[-1]} ({copied}) ({human_readable_size(file_size)}) ', end='')
+            debug(f'Copied {file} to {output_file}')
+    finally:
+        if index is not None:
+            index.close()
+        if manifest is not None:
+            manifest.close()
     if not args.verbose:
         print("\33[2K\r", end='')
-        print(f'Copied {len(files)} files ({human_readable_size(total_size)})')
+        print(f'Copied {copied} files ({human_readable_size(total_size)})')
+    if converter is not None:
+        debug(f'Waiting for {len([future for future in conversions if not future.done()])} conversions to finish')
+        try:
+            converted, failed, _ = convert_report(conversions, len(conversions))
+        finally:
+            converter.close()
+        print(f'Converted {converted} raw files')
+        if failed:
+            colors.error(f'{failed} conversions failed')
+    if corrupted:
+        colors.error(f'{len(corrupted)} files failed verification and were not kept, run the copy again to retry them:')
+        for file in corrupted:
+            colors.error(f'  {file}')
     debug('Finished copying files')
     end_connection()
 
 
+def sync_previews(args, debug):
+    # Download the preview rendition of every item that is not cached yet.
+    # Returns (previews fetched, previews in the directory, bytes fetched).
+    from ..copy import wifi
+    cache = PreviewCache(args.previews)
+    items = {}
+
+    def missing_previews():
+        for item in wifi.list_previews(args.batch_size, args.preview_size):
+            if cache.cached(item):
+                continue
+            path = cache.preview_path(item)
+            items[path] = item
+            yield item.preview, path
+
+    fetched = 0
+    total_size = 0
+    try:
+        for _, path, file_size, _ in copy_files(missing_previews(), wifi.copy_file, wifi.get_file_size, args.jobs):
+            cache.add(items.pop(path), path)
+            fetched += 1
+            total_size += file_size
+            debug(f'Fetched {path}')
+    finally:
+        cache.save()
+    return fetched, len(cache.items), total_size
+
+
+def copy_files(files, copy_file, get_file_size, jobs: int, verify: bool = False):
+    # Copy files with up to `jobs` transfers in flight, yielding (file, output_file, size, checksum)
+    # in the original order so progress stays readable.
+    # checksum is None, or (digest, source digest or None) when verifying.
+    def copy_one(file, output_file):
+        file_size = get_file_size(file)
+        if verify:
+            return file_size, copy_file(file, output_file, verify=True)
+        copy_file(file, output_file)
+        return file_size, None
+
+    jobs = max(jobs, 1)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for file, output_file in files:
+            pending.append((file, output_file, executor.submit(copy_one, file, output_file)))
+            # Keep a bounded window of queued transfers instead of submitting the whole card
+            if len(pending) >= jobs * 2:
+                file, output_file, future = pending.popleft()
+                yield (file, output_file, *future.result())
+        while pending:
+            file, output_file, future = pending.popleft()
+            yield (file, output_file, *future.result())
+
+
 def human_readable_size(size: int):
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
         if size < 1024:
@@ -68,6 +213,10 @@ def human_readable_size(size: int):
 
 
 def filter_files(files: list, args: argparse.Namespace, debug, get_file_size, get_file_mtime, get_dest_name):
+    return list(iter_filter_files(files, args, debug, get_file_size, get_file_mtime, get_dest_name))
+
+
+def iter_filter_files(files, args: argparse.Namespace, debug, get_file_size, get_file_mtime, get_dest_name, index=None, get_file_key=None):
     debug(f'Filtering files by extension: {args.extension}')
     # Used to check if the file exists locally
     debug(f'Checking if output directory exists')
@@ -75,44 +224,76 @@ def filter_files(files: list, args: argparse.Namespace, debug, get_file_size, ge
         debug(f'Output directory does not exist, creating it')
         os.makedirs(args.output)
     debug(f'Output directory exists')
-    output = []
+    # List the output directory once instead of probing it for every file.
+    # Names handed out during this run are added with a None entry.
+    existing = {entry.name: entry for entry in os.scandir(args.output) if entry.is_file()}
     for file in files:
-        if not file_type_match(args.extension, file):
+        if not file_type_match(args.extension, str(file)):
             debug(f'Skipping file {file} because it does not match extension {args.extension}')
             continue
-        output_file = os.path.join(args.output, get_dest_name(file))
-        if os.path.isfile(output_file) and os.path.getsize(output_file) == get_file_size(file) and (args.conn_type == 'wifi' or os.path.getmtime(output_file) == get_file_mtime(file)):
-            debug(f'Skipping file {file} because it already exists locally (same size and modification time)')
+        if index is not None and get_file_key(file) in index:
+            debug(f'Skipping file {file} because it was already imported as {index.get(get_file_key(file))}')
+            continue
+        output_file, copied_as = place_file(file, os.path.join(args.output, get_dest_name(file)), get_file_size(file),
+                                            get_file_mtime(file) if args.conn_type != 'wifi' else None, args.if_exists, existing, debug)
+        if output_file is None:
+            if copied_as is not None and index is not None:
+                index.add(get_file_key(file), copied_as)
             continue
-        if os.path.isfile(output_file):
-            # The file exists locally but it is different
-            debug(f'File {file} exists locally but it is different')
-            if args.if_exists == 'skip':
-                debug(f'Skipping file {file} because it already exists locally')
-                continue
-            elif args.if_exists == 'rename':
-                debug(f'Renaming file {file} because it already exists locally')
-                output_file = rename_file(output_file, get_file_mtime(file), get_file_size(file))
-                if output_file is None:
-                    debug(f'{file} already exists locally as {output_file}, skipping')
-                    continue
-                debug(f'New file name: {output_file}')
-            elif args.if_exists == 'overwrite':
-                debug(f'Overwriting file {file}')
-        output.append((file, output_file))
         debug(f'Adding file {file} to output list with output file {output_file}')
-    return output
+        yield file, output_file
+
+
+def place_file(file, output_file: str, source_size: int, source_mtime, if_exists: str, existing: dict, debug):
+    # Where to copy file, given the output directory's files (existing, name -> DirEntry,
+    # updated with the name handed out). Returns (path, None) to copy it to path, or
+    # (None, path) when it is already there as path, or (None, None) to skip it.
+    dest_name = os.path.basename(output_file)
+    if same_file(existing.get(dest_name), source_size, source_mtime):
+        debug(f'Skipping file {file} because it already exists locally (same size and modification time)')
+        return None, output_file
+    if dest_name in existing:
+        # The file exists locally but it is different
+        debug(f'File {file} exists locally but it is different')
+        if if_exists == 'skip':
+            debug(f'Skipping file {file} because it already exists locally')
+            return None, None
+        elif if_exists == 'rename':
+            debug(f'Renaming file {file} because it already exists locally')
+            renamed = rename_file(output_file, source_mtime, source_size, existing)
+            if renamed is None:
+                debug(f'{file} already exists locally under another name, skipping')
+                return None, output_file
+            output_file = renamed
+            debug(f'New file name: {output_file}')
+        elif if_exists == 'overwrite':
+            debug(f'Overwriting file {file}')
+    existing.setdefault(os.path.basename(output_file), None)
+    return output_file, None
 
 
-def rename_file(file: str, source_mtime: float, source_size: int):
+def same_file(entry, source_size: int, source_mtime):
+    # entry is a DirEntry from the output directory, or None if it does not exist yet.
+    # The mtime is only compared when the source has one (USB copies).
+    if entry is None:
+        return False
+    stat = entry.stat()
+    return stat.st_size == source_size and (source_mtime is None or stat.st_mtime == source_mtime)
+
+
+def rename_file(file: str, source_mtime: float, source_size: int, existing: dict = None):
     # Output format: file_1.ext
-    file_name, file_ext = os.path.splitext(file)
+    if existing is None:
+        existing = {entry.name: entry for entry in os.scandir(os.path.dirname(file) or ".") if entry.is_file()}
+    directory = os.path.dirname(file)
+    file_name, file_ext = os.path.splitext(os.path.basename(file))
+    name = os.path.basename(file)
     i = 1
-    while os.path.isfile(file):
+    while name in existing:
         # Prevent copying the same file twice: it could happen if the normal file and the renamed file have the same size and modification time
-        if os.path.isfile(file) and os.path.getsize(file) == source_size and os.path.getmtime(file) == source_mtime:
+        entry = existing[name]
+        if entry is not None and entry.stat().st_size == source_size and entry.stat().st_mtime == source_mtime:
             return None
-        file = f'{file_name}_{i}{file_ext}'
+        name = f'{file_name}_{i}{file_ext}'
         i += 1
-    return file
-
+    return os.path.join(directory, name)
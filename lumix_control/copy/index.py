@@ -0,0 +1,52 @@
+import os
+import sqlite3
+
+INDEX_FILE_NAME = ".lumix-control-index.sqlite"
+
+
+class TransferIndex:
+    # Remembers which camera files were already imported into an output directory,
+    # keyed by (camera file name, size, date) so renamed copies are still recognized.
+    def __init__(self, directory: str, commit_every: int = 50):
+        self.path = os.path.join(directory, INDEX_FILE_NAME)
+        self.commit_every = commit_every
+        self.pending = 0
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS imported ("
+            "name TEXT NOT NULL, size INTEGER NOT NULL, date TEXT NOT NULL, dest TEXT NOT NULL, "
+            "PRIMARY KEY (name, size, date))"
+        )
+        # Load everything at once so lookups during filtering are plain dict hits
+        self.known = {
+            (name, size, date): dest
+            for name, size, date, dest in self.connection.execute("SELECT name, size, date, dest FROM imported")
+        }
+
+    def __contains__(self, key) -> bool:
+        return key in self.known
+
+    def __len__(self) -> int:
+        return len(self.known)
+
+    def get(self, key):
+        return self.known.get(key)
+
+    def add(self, key, dest: str):
+        name, size, date = key
+        self.known[key] = dest
+        self.connection.execute(
+            "INSERT OR REPLACE INTO imported (name, size, date, dest) VALUES (?, ?, ?, ?)",
+            (name, size, date, os.path.basename(dest)),
+        )
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,107 @@
+import json
+import os
+import re
+
+# The camera lists three resources per item: DO (original), DL (large preview) and DT (thumbnail)
+PREVIEW_PREFIXES = {"thumbnail": "DT", "large": "DL"}
+MANIFEST_FILE_NAME = ".lumix-control-previews.json"
+
+
+class PreviewItem:
+    # One camera item with the resources needed for a preview sync
+    __slots__ = ("object_id", "original", "preview")
+
+    def __init__(self, object_id, original, preview):
+        self.object_id = object_id
+        self.original = original
+        self.preview = preview
+
+    @property
+    def name(self):
+        # Local name of the original, as `copy wifi` names it
+        return self.original.local_name
+
+
+def iter_items(entries, size="thumbnail"):
+    # Group the resources the listing yields (all resources of an item come one after
+    # another) into PreviewItems. Items without a preview of that size are skipped.
+    prefix = PREVIEW_PREFIXES[size]
+    object_id = None
+    resources = {}
+    for entry in entries:
+        if entry.object_id != object_id:
+            if "DO" in resources and prefix in resources:
+                yield PreviewItem(object_id, resources["DO"], resources[prefix])
+            object_id = entry.object_id
+            resources = {}
+        resources.setdefault(entry.name[:2], entry)
+    if "DO" in resources and prefix in resources:
+        yield PreviewItem(object_id, resources["DO"], resources[prefix])
+
+
+def safe_id(object_id) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(object_id))
+
+
+class PreviewCache:
+    # Previews of an output directory, keyed by content ID. The manifest maps each content
+    # ID to the original's name and the preview file, so a preview is only downloaded once
+    # and the files left in the directory can be mapped back to camera items.
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_FILE_NAME)
+        os.makedirs(directory, exist_ok=True)
+        self.items = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                self.items = json.load(f)
+
+    def preview_path(self, item: PreviewItem) -> str:
+        # Readable names to browse by, the content ID keeps them unique
+        stem = os.path.splitext(item.name)[0]
+        return os.path.join(self.directory, f"{stem}_{safe_id(item.object_id)}.jpg")
+
+    def cached(self, item: PreviewItem) -> bool:
+        known = self.items.get(str(item.object_id))
+        return (known is not None and known["size"] == item.preview.size and known["original"] == item.original.name
+                and os.path.isfile(os.path.join(self.directory, known["preview"])))
+
+    def add(self, item: PreviewItem, path: str):
+        self.items[str(item.object_id)] = {
+            "original": item.original.name,
+            "name": item.name,
+            "size": item.preview.size,
+            "preview": os.path.basename(path),
+        }
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.items, f, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def load_selection(path: str) -> set:
+    # A preview directory selects the items whose previews are still in it (delete the
+    # previews of the shots you don't want). Any other file is a list of names or content
+    # IDs, one per line. Returns a set of content IDs and local names (without extension):
+    # the names are what a USB copy matches, it has no content IDs.
+    selection = set()
+    if os.path.isdir(path):
+        cache = PreviewCache(path)
+        for object_id, known in cache.items.items():
+            if os.path.isfile(os.path.join(path, known["preview"])):
+                selection.add(object_id)
+                selection.add(os.path.splitext(known["name"])[0])
+        return selection
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                selection.add(os.path.splitext(os.path.basename(line))[0])
+                selection.add(line)
+    return selection
+
+
+def is_selected(selection: set, file, dest_name: str) -> bool:
+    object_id = getattr(file, "object_id", None)
+    return (object_id is not None and str(object_id) in selection) or os.path.splitext(dest_name)[0] in selection
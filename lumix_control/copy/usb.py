@@ -1,12 +1,19 @@
-import shutil
 from .. import colors
 debug = colors.debug
 error = colors.error
 info = colors.info
 
+from .verify import DIGEST, hash_file
+
+import errno
+import hashlib
+import stat
 import subprocess
 import os
 
+# Size of each read/write (or copy_file_range/sendfile call) when copying from the card
+buffer_size = 8 * 1024 * 1024
+
 GX80_UUID = "9016-4EF8"
 GX80_PATH = "/dev/disk/by-uuid/" + GX80_UUID
 GX80_MOUNTPOINT = "/tmp/gx80"
@@ -39,24 +46,53 @@ def mount():
         exit(1)
 
 
-def list_files():
+class FileRecord:
+    # A file on the card with the result of its single stat call, so the rest of the
+    # pipeline never has to query the (slow FAT/exFAT) card again
+    __slots__ = ("path", "size", "mtime", "mtime_ns", "atime_ns", "mode")
+
+    def __init__(self, path, stat_result):
+        self.path = path
+        self.size = stat_result.st_size
+        self.mtime = stat_result.st_mtime
+        self.mtime_ns = stat_result.st_mtime_ns
+        self.atime_ns = stat_result.st_atime_ns
+        self.mode = stat_result.st_mode
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    def __fspath__(self):
+        return self.path
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return f"FileRecord({self.path!r}, size={self.size})"
+
+
+def list_files(_=None, root=GX80_DCIM_PATH): # first argument used by wifi version
     def recursive_list_files(path):
         files = []
-        for f in os.listdir(path):
-            if os.path.isdir(os.path.join(path, f)):
-                files.extend(recursive_list_files(os.path.join(path, f)))
-            else:
-                files.append(os.path.join(path, f))
+        with os.scandir(path) as entries:
+            for entry in entries:
+                # is_dir() comes from the directory listing itself, only files get a stat call
+                if entry.is_dir(follow_symlinks=False):
+                    files.extend(recursive_list_files(entry.path))
+                else:
+                    files.append(FileRecord(entry.path, entry.stat(follow_symlinks=False)))
         return files
     try:
-        files = recursive_list_files(GX80_DCIM_PATH)
+        files = recursive_list_files(root)
     except FileNotFoundError as e:
         error("Failed to list files on the camera")
         raise e
     return files
 
 
-def start_connection(_): # argument used by wifi version
+def start_connection(_, jobs=1, soap_port=None): # arguments used by wifi version
     check_connected()
     mount()
 
@@ -66,15 +102,99 @@ def end_connection():
     debug("Removing mountpoint")
     os.rmdir(GX80_MOUNTPOINT)
 
-def copy_file(file, destination):
+def copy_file(file: FileRecord, destination, verify=False):
+    # With verify, returns the digest of the data written and the digest of a second
+    # read of the card; they only differ if one of the reads was corrupted.
     debug(f"Copying {file} to {destination}")
-    shutil.copy2(file, destination)
+    with open(file.path, "rb") as source, open(destination, "wb") as dest:
+        if verify:
+            # The data has to pass through userspace to be hashed, so no kernel copy
+            digest = hash_data(source, dest)
+        else:
+            copy_data(source, dest, file.size)
+    # Keep the modification time: filter_files uses it to detect already copied files.
+    # Same as shutil.copystat, but from the record instead of another stat of the card.
+    os.chmod(destination, stat.S_IMODE(file.mode))
+    os.utime(destination, ns=(file.atime_ns, file.mtime_ns))
+    if verify:
+        return digest, hash_file(file.path, buffer_size, drop_cache=True)
+
+def copy_data(source, dest, size: int):
+    # Let the kernel move the data when it can, otherwise copy through one large buffer
+    if size and hasattr(os, "copy_file_range"):
+        try:
+            return kernel_copy(os.copy_file_range, source, dest, size)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF):
+                raise
+    if size and hasattr(os, "sendfile"):
+        try:
+            return kernel_copy(lambda src, dst, count: os.sendfile(dst, src, None, count), source, dest, size)
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF):
+                raise
+    buffer = memoryview(bytearray(buffer_size))
+    while True:
+        read = source.readinto(buffer)
+        if not read:
+            return
+        dest.write(buffer[:read])
+
+def hash_data(source, dest) -> str:
+    # Same as the copy_data fallback, hashing every block on its way through
+    hasher = hashlib.new(DIGEST)
+    buffer = memoryview(bytearray(buffer_size))
+    while True:
+        read = source.readinto(buffer)
+        if not read:
+            return hasher.hexdigest()
+        hasher.update(buffer[:read])
+        dest.write(buffer[:read])
+
+def kernel_copy(function, source, dest, size: int):
+    # function(src_fd, dst_fd, count) copies from the current offsets, like copy_file_range
+    source_fd, dest_fd = source.fileno(), dest.fileno()
+    copied = 0
+    while copied < size:
+        sent = function(source_fd, dest_fd, min(buffer_size, size - copied))
+        if sent == 0:
+            break
+        copied += sent
+    if copied == 0 and size:
+        # Nothing was copied: let the caller try the next method from the start
+        raise OSError(errno.EINVAL, "kernel copy did not copy anything")
+
+def block_device_rotational(path: str) -> bool:
+    # Look up the queue/rotational flag of the disk holding path. Partitions don't have
+    # a queue directory of their own, so also look at the parent device.
+    device = os.stat(path).st_dev
+    sys_path = f"/sys/dev/block/{os.major(device)}:{os.minor(device)}"
+    for queue in (os.path.join(sys_path, "queue"), os.path.join(sys_path, "..", "queue")):
+        try:
+            with open(os.path.join(queue, "rotational")) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return False
+
+def suggest_jobs(source: str, destination: str) -> int:
+    # Parallel copies only help when reading and writing hit different devices, and
+    # spinning disks (card readers often claim to be one) don't like many streams at once
+    if os.stat(source).st_dev == os.stat(destination).st_dev:
+        return 1
+    if block_device_rotational(source) or block_device_rotational(destination):
+        return 2
+    return 4
+
+def get_file_size(file: FileRecord) -> int:
+    return file.size
 
-def get_file_size(file: str) -> int:
-    return os.path.getsize(file)
+def get_file_mtime(file: FileRecord) -> float:
+    return file.mtime
 
-def get_file_mtime(file: str) -> float:
-    return os.path.getmtime(file)
+def get_file_key(file: FileRecord) -> tuple:
+    # Identifies the camera file in the transfer index
+    return (file.name, file.size, repr(file.mtime))
 
-def get_dest_name(file: str) -> str:
-    return os.path.basename(file)
+def get_dest_name(file: FileRecord) -> str:
+    return file.name
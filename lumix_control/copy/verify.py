@@ -0,0 +1,62 @@
+import hashlib
+import os
+
+# sha256sum-compatible: `sha256sum -c .lumix-control.sha256` in the output directory
+# checks every verified copy again.
+DIGEST = "sha256"
+MANIFEST_FILE_NAME = ".lumix-control.sha256"
+
+
+def hash_file(path, buffer_size=8 * 1024 * 1024, drop_cache=False):
+    # drop_cache asks the kernel to forget the cached pages first, so the data really
+    # comes from the device again instead of from memory
+    hasher = hashlib.new(DIGEST)
+    with open(path, "rb", buffering=0) as f:
+        if drop_cache and hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        buffer = memoryview(bytearray(buffer_size))
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            hasher.update(buffer[:read])
+    return hasher.hexdigest()
+
+
+class Manifest:
+    # Digests of the verified files of an output directory, one "digest  name" line each.
+    # Lines are appended as files are copied, a later line for the same name wins.
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, MANIFEST_FILE_NAME)
+        self.digests = {}
+        self.lines = 0
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    digest, _, name = line.rstrip("\n").partition("  ")
+                    if name:
+                        self.digests[name] = digest
+                        self.lines += 1
+        self.file = open(self.path, "a")
+
+    def __len__(self) -> int:
+        return len(self.digests)
+
+    def get(self, name: str):
+        return self.digests.get(name)
+
+    def add(self, dest: str, digest: str):
+        name = os.path.basename(dest)
+        self.digests[name] = digest
+        self.file.write(f"{digest}  {name}\n")
+        self.file.flush()
+        self.lines += 1
+
+    def close(self):
+        self.file.close()
+        if self.lines > len(self.digests):
+            # Files were copied again: rewrite the manifest without the stale lines
+            with open(self.path + ".tmp", "w") as f:
+                for name, digest in self.digests.items():
+                    f.write(f"{digest}  {name}\n")
+            os.replace(self.path + ".tmp", self.path)
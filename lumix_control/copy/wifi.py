@@ -4,37 +4,58 @@ debug = colors.debug
 error = colors.error
 
 from .. import lumix_control
+from .verify import DIGEST
+from . import preview
 
-def start_connection(ip: str):
+def start_connection(ip: str, jobs: int = 1, soap_port: int = 60606):
     global camera
     debug(f"Connecting to camera at {ip}")
     try:
-        camera = lumix_control.CameraControl(ip)
+        camera = lumix_control.CameraControl(ip, pool_size=jobs, soap_port=soap_port)
     except Exception:
         error(f"Error connecting to camera. Verify that the IP address is correct and that you are connected to the camera's access point.")
         exit(1)
+    debug("Switching camera to playmode")
+    if not camera.enter_playmode():
+        error("Error switching the camera to playmode.")
+        exit(1)
+
 
+def list_files(batch_size: int = 500):
+    # Sizes come from the DIDL-Lite listing, so no HEAD request is needed per file.
+    # This is a generator: later pages are only fetched once the earlier ones are consumed.
+    return (
+            entry
+            for entry in camera.iter_pictures(batch_size)
+            if entry.name.startswith("DO") # Filter out thumbnails
+            )
 
-def list_files():
-    files = [
-            file
-            for file in camera.get_picture_urls()
-            if file.split("/")[-1].startswith("DO") # Filter out thumbnails
-            ]
-    return files
+def list_previews(batch_size: int = 500, size: str = "thumbnail"):
+    # Items with their original and the preview rendition of that size
+    return preview.iter_items(camera.iter_pictures(batch_size), size)
 
-def copy_file(url: str, path: str):
-    camera.download_picture(url, path)
+def copy_file(entry, path: str, verify: bool = False):
+    # The camera has no checksums to compare with: the digest of the stream is returned
+    # without a source digest (see usb.copy_file)
+    digest = camera.download_picture(entry.url, path, size=get_file_size(entry), digest=DIGEST if verify else None, date=entry.date)
+    if verify:
+        return digest, None
 
-def get_dest_name(url: str):
-    return url.split("/")[-1].replace("DO", "P").replace(".RAW", ".RW2")
+def get_dest_name(entry):
+    return entry.local_name
 
-def get_file_size(url: str):
-    return camera.get_remote_size(url)
+def get_file_size(entry):
+    if entry.size is None:
+        # Older firmwares may omit the size attribute
+        entry.size = camera.get_remote_size(entry.url)
+    return entry.size
 
 def get_file_mtime(*args, **kwargs):
     return None
 
+def get_file_key(entry):
+    return entry.index_key(get_file_size(entry))
+
 
 def end_connection():
     camera.close()
@@ -0,0 +1,221 @@
+import bisect
+import math
+
+# 256 between full stops. The rest are third stops.
+# See http://c710720.r20.cf2.rackcdn.com/wp-content/uploads/2011/08/ISO-Shutter-Speeds-Fstops-Copyright-2009-2011-photographyuncapped.gif
+FSTOPS = {
+    "1": "0/256",
+    "1.1": "85/256",
+    "1.2": "171/256",
+    "1.4": "256/256",
+    "1.6": "341/256",
+    "1.8": "427/256",
+    "2": "512/256",
+    "2.2": "597/256",
+    "2.4": "640/256",
+    "2.8": "768/256",
+    "3.2": "853/256",
+    "3.5": "939/256",
+    "4": "1024/256",
+    "4.5": "1110/256",
+    "5": "1195/256",
+    "5.6": "1280/256",
+    "6.3": "1364/256",
+    "7.1": "1451/256",
+    "8": "1536/256",
+    "9": "1621/256",
+    "10": "1707/256",
+    "11": "1792/256",
+    "13": "1877/256",
+    "14": "1963/256",
+    "16": "2048/256",
+    "18": "2133/256",
+    "20": "2219/256",
+    "22": "2304/256"
+}
+
+# 256 between full stops. 1 second is the pos/neg boundary
+# See http://c710720.r20.cf2.rackcdn.com/wp-content/uploads/2011/08/ISO-Shutter-Speeds-Fstops-Copyright-2009-2011-photographyuncapped.gif
+SHUTTER_SPEEDS = {
+    "4000": "3072/256",
+    "3200": "2987/256",
+    "2500": "2902/256",
+    "2000": "2816/256",
+    "1600": "2731/256",
+    "1300": "2646/256",
+    "1000": "2560/256",
+    "800": "2475/256",
+    "640": "2390/256",
+    "500": "2304/256",
+    "400": "2219/256",
+    "320": "2134/256",
+    "250": "2048/256",
+    "200": "1963/256",
+    "160": "1878/256",
+    "125": "1792/256",
+    "100": "1707/256",
+    "80": "1622/256",
+    "60": "1536/256",
+    "50": "1451/256",
+    "40": "1366/256",
+    "30": "1280/256",
+    "25": "1195/256",
+    "20": "1110/256",
+    "15": "1024/256",
+    "13": "939/256",
+    "10": "854/256",
+    "8": "768/256",
+    "6": "683/256",
+    "5": "598/256",
+    "4": "512/256",
+    "3.2": "427/256",
+    "2.5": "342/256",
+    "2": "256/256",
+    "1.6": "171/256",
+    "1.3": "86/256",
+    "1": "0/256",
+    "1.3s": "-85/256",
+    "1.6s": "-170/256",
+    "2s": "-256/256",
+    "2.5s": "-341/256",
+    "3.2s": "-426/256",
+    "4s": "-512/256",
+    "5s": "-682/256",
+    "6s": "-768/256",
+    "8s": "-853/256",
+    "10s": "-938/256",
+    "13s": "-1024/256",
+    "15s": "-1109/256",
+    "20s": "-1194/256",
+    "25s": "-1280/256",
+    "30s": "-1365/256",
+    "40s": "-1450/256",
+    "50s": "-1536/256",
+    "60s": "16384/256",
+    "B": "256/256"
+}
+
+# GX80 ISO range, extended ISO 100 included, in third stops
+ISO_VALUES = [100, 125, 160, 200, 250, 320, 400, 500, 640, 800, 1000, 1250, 1600, 2000, 2500,
+              3200, 4000, 5000, 6400, 8000, 10000, 12800, 16000, 20000, 25600]
+
+
+class Stop:
+    # One valid setting: its APEX value (Av, Tv or Sv), a readable label and the value cam.cgi expects
+    __slots__ = ("apex", "label", "value")
+
+    def __init__(self, apex, label, value):
+        self.apex = apex
+        self.label = label
+        self.value = value
+
+    def __repr__(self):
+        return "Stop({0!r}, {1!r})".format(self.label, self.value)
+
+
+def camera_apex(value):
+    # "1280/256" -> 5.0
+    numerator, _, denominator = value.partition("/")
+    return int(numerator) / int(denominator)
+
+
+def shutter_label(key):
+    # SHUTTER_SPEEDS keys are denominators ("250") or seconds ("2s")
+    return key[:-1] + '"' if key.endswith("s") else "1/" + key
+
+
+# Sorted by APEX value so a bisect finds the nearest stop. The 60s and bulb entries
+# of SHUTTER_SPEEDS don't follow the APEX scale and are only reachable by name.
+APERTURE_STOPS = sorted((Stop(camera_apex(value), "f/" + key, value) for key, value in FSTOPS.items()), key=lambda stop: stop.apex)
+SHUTTER_STOPS = sorted((Stop(camera_apex(value), shutter_label(key), value) for key, value in SHUTTER_SPEEDS.items() if key not in ("60s", "B")), key=lambda stop: stop.apex)
+ISO_STOPS = [Stop(math.log2(iso / 3.125), "ISO " + str(iso), str(iso)) for iso in ISO_VALUES]
+APERTURE_APEX = [stop.apex for stop in APERTURE_STOPS]
+SHUTTER_APEX = [stop.apex for stop in SHUTTER_STOPS]
+ISO_APEX = [stop.apex for stop in ISO_STOPS]
+
+
+STOP_TOLERANCE = 1 / 6
+
+
+def nearest(stops, keys, apex, low=None, high=None):
+    # Nearest stop to apex, only considering stops between the low and high APEX limits
+    first = bisect.bisect_left(keys, low - 1e-6) if low is not None else 0
+    last = bisect.bisect_right(keys, high + 1e-6) if high is not None else len(keys)
+    if first >= last:
+        raise Exception("No valid stop between {0} and {1}".format(low, high))
+    i = min(max(bisect.bisect_left(keys, apex, first, last), first), last - 1)
+    if i > first and apex - keys[i - 1] <= keys[i] - apex:
+        i -= 1
+    return stops[i]
+
+
+def in_range(keys, apex, low=None, high=None):
+    # Values up to half a third stop past the ends of the table still round to the last stop
+    first = max(keys[0], low) if low is not None else keys[0]
+    last = min(keys[-1], high) if high is not None else keys[-1]
+    return first - STOP_TOLERANCE <= apex <= last + STOP_TOLERANCE
+
+
+def parse_number(value):
+    if isinstance(value, str):
+        value = value.strip()
+        numerator, slash, denominator = value.partition("/")
+        if slash:
+            return float(numerator) / float(denominator)
+    return float(value)
+
+
+def aperture_stop(value, lens=None):
+    # value is an f-number: 5.6, "5.5" or "f/8". lens (a LensInfo) limits the result to what the lens can do.
+    if isinstance(value, str):
+        value = value.strip()
+        if value.lower().startswith("f/"):
+            value = value[2:]
+    f_number = parse_number(value)
+    if f_number <= 0:
+        raise Exception("Invalid aperture: {0}".format(value))
+    low, high = (lens.min_aperture, lens.max_aperture) if lens is not None else (None, None)
+    return nearest(APERTURE_STOPS, APERTURE_APEX, 2 * math.log2(f_number), low, high)
+
+
+def shutter_stop(value, lens=None):
+    # A number is an exposure time in seconds (1/250, 0.5, 2): 250 means 250 seconds,
+    # not 1/250. Strings are read like the SHUTTER_SPEEDS keys: a bare number is a
+    # denominator ("250" and "5.5" are 1/250 and 1/5.5), seconds end with s or " ("2s",
+    # '2"'), "1/250" is a fraction, and "60s" and "B" (bulb) are only reachable by name.
+    # Anything outside the table (or the lens limits) raises ValueError instead of being
+    # clamped, so a misread value never turns into a long exposure.
+    if isinstance(value, str):
+        text = value.strip()
+        if text in ("60s", "B"):
+            return Stop(None, shutter_label(text) if text != "B" else "B", SHUTTER_SPEEDS[text])
+        try:
+            if text.endswith(("s", '"')):
+                seconds = float(text[:-1])
+            elif "/" in text:
+                seconds = parse_number(text)
+            else:
+                seconds = 1 / float(text)
+        except ZeroDivisionError:
+            seconds = 0
+    else:
+        seconds = float(value)
+    if seconds <= 0:
+        raise ValueError("Invalid shutter speed: {0}".format(value))
+    low, high = (lens.min_shutter, lens.max_shutter) if lens is not None else (None, None)
+    apex = -math.log2(seconds)
+    if not in_range(SHUTTER_APEX, apex, low, high):
+        if not isinstance(value, str) and seconds >= 1:
+            raise ValueError("No shutter speed of {0} seconds, use \"{1}\" for 1/{1}".format(value, int(value)))
+        raise ValueError("Shutter speed {0!r} is outside what the camera and lens support".format(value))
+    return nearest(SHUTTER_STOPS, SHUTTER_APEX, apex, low, high)
+
+
+def iso_stop(value):
+    # Numbers go to the nearest third stop. cam.cgi takes "50" for auto ISO.
+    if isinstance(value, str) and value.strip().lower() == "auto":
+        return Stop(None, "ISO auto", "50")
+    iso = parse_number(value)
+    if iso <= 0:
+        raise Exception("Invalid ISO: {0}".format(value))
+    return nearest(ISO_STOPS, ISO_APEX, math.log2(iso / 3.125))
@@ -0,0 +1,153 @@
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Moving "tele" lowers the reported focus position, "wide" raises it
+DIRECTIONS = {-1: "tele", 1: "wide"}
+
+
+def ease_in_out(x):
+    return (1 - math.cos(math.pi * x)) / 2
+
+
+def linear(x):
+    return x
+
+
+EASINGS = {"linear": linear, "ease_in_out": ease_in_out}
+
+
+def inverse(function, y, iterations=30):
+    # Invert a monotonic easing function on [0, 1] by bisection
+    low, high = 0.0, 1.0
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        if function(middle) < y:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+class FocusEngine:
+    # Drives manual focus with camctrl focus steps.
+    # The size of a step at each speed is learned from the position deltas the camera
+    # reports, moves are planned as the fewest fast/normal steps, and up to
+    # pipeline_depth steps are in flight at once instead of waiting for every reply.
+    def __init__(self, camera, fast_step=70, normal_step=13, pipeline_depth=2, smoothing=0.3):
+        self.camera = camera
+        self.step_size = {"fast": float(fast_step), "normal": float(normal_step)}
+        self.pipeline_depth = max(pipeline_depth, 1)
+        self.smoothing = smoothing
+        self.latency = None
+        self.position = None
+        self.last_speed = None
+        self.trace = []
+        self.executor = ThreadPoolExecutor(max_workers=self.pipeline_depth)
+
+    def send(self, direction, speed):
+        sent = time.monotonic()
+        reply = self.camera.focus_control(direction, speed)
+        if not reply.ok or reply.position is None:
+            raise Exception("Focus command failed: {0}".format(reply.text))
+        return sent, time.monotonic() - sent, reply.position
+
+    def record(self, speed, steps, sent, latency, position):
+        # Learn from one reply, `steps` steps after the previously known position.
+        # Pipelined replies can arrive interleaved, so only learn between steps of the same speed.
+        if self.position is not None and steps and speed == self.last_speed:
+            delta = abs(position - self.position) / steps
+            # A delta of 0 means the lens hit an end stop, which says nothing about the step size
+            if delta:
+                self.step_size[speed] += self.smoothing * (delta - self.step_size[speed])
+        self.latency = latency if self.latency is None else self.latency + self.smoothing * (latency - self.latency)
+        self.position = position
+        self.last_speed = speed if steps else None
+        self.trace.append((sent + latency, position))
+
+    def read_position(self):
+        # There is no way to query the position without moving: take one fine step
+        sent, latency, position = self.send("tele", "normal")
+        self.position = None
+        self.record("normal", 0, sent, latency, position)
+        return position
+
+    def plan(self, distance, allow_fast=True):
+        # Fewest steps that get within half a normal step of `distance`
+        distance = abs(distance)
+        fast, normal = self.step_size["fast"], self.step_size["normal"]
+        if not allow_fast:
+            return ["normal"] * int(round(distance / normal))
+        candidates = []
+        for fast_steps in {int(distance // fast), int(math.ceil(distance / fast))}:
+            rest = distance - fast_steps * fast
+            normal_steps = max(int(round(rest / normal)), 0)
+            error = abs(rest - normal_steps * normal)
+            candidates.append((error > normal / 2, fast_steps + normal_steps, error, fast_steps, normal_steps))
+        _, _, _, fast_steps, normal_steps = min(candidates)
+        return ["fast"] * fast_steps + ["normal"] * normal_steps
+
+    def run(self, direction, speeds, schedule=None, origin=None):
+        # Send the planned steps with at most pipeline_depth of them in flight.
+        # With a schedule, step i is not sent before origin + schedule[i].
+        origin = time.monotonic() if origin is None else origin
+        pending = []
+        for i, speed in enumerate(speeds):
+            if schedule is not None:
+                delay = origin + schedule[i] - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            pending.append((speed, self.executor.submit(self.send, direction, speed)))
+            while len(pending) >= self.pipeline_depth or (pending and pending[0][1].done()):
+                speed, future = pending.pop(0)
+                self.record(speed, 1, *future.result())
+        for speed, future in pending:
+            self.record(speed, 1, *future.result())
+        return self.position
+
+    def move_to(self, target, allow_fast=True, max_passes=5):
+        # Closed loop: plan, run, then re-plan from the reported position
+        target = int(target)
+        if self.position is None:
+            self.read_position()
+        for _ in range(max_passes):
+            distance = target - self.position
+            if abs(distance) <= self.step_size["normal"] / 2:
+                break
+            speeds = self.plan(distance, allow_fast)
+            if not speeds:
+                break
+            self.run(DIRECTIONS[1 if distance > 0 else -1], speeds)
+        return self.position
+
+    def rack(self, start, end, duration=None, easing="ease_in_out", allow_fast=True):
+        # Pull focus from start to end. With a duration, steps are spread over that time
+        # following the easing curve. Returns the (seconds, position) trace of the pull.
+        self.move_to(start)
+        origin = time.monotonic()
+        self.trace = [(origin, self.position)]
+        distance = int(end) - self.position
+        if distance == 0:
+            return [(0.0, self.position)]
+        speeds = self.plan(distance, allow_fast)
+        schedule = None
+        if duration and speeds:
+            # Prefer fine steps if they fit in the requested time, they make a smoother pull
+            normal_only = self.plan(distance, allow_fast=False)
+            step_time = (self.latency or 0) / self.pipeline_depth
+            if len(normal_only) * step_time <= duration:
+                speeds = normal_only
+            ease = EASINGS[easing]
+            total = sum(self.step_size[speed] for speed in speeds)
+            covered = 0
+            schedule = []
+            for speed in speeds:
+                schedule.append(duration * inverse(ease, covered / total))
+                covered += self.step_size[speed]
+        self.run(DIRECTIONS[1 if distance > 0 else -1], speeds, schedule, origin)
+        # Correct whatever the learned step sizes got wrong
+        self.move_to(end, allow_fast)
+        return [(timestamp - origin, position) for timestamp, position in self.trace]
+
+    def close(self):
+        self.executor.shutdown()
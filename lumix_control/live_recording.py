@@ -0,0 +1,152 @@
+import mmap
+import struct
+import time
+
+from .live_view import Frame
+
+# File layout: HEADER, the JPEG frames back to back, the index (one INDEX_ENTRY per
+# frame) and finally the TRAILER pointing at the index.
+MAGIC = b"LXLV"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+INDEX_ENTRY = struct.Struct("<dQI")  # seconds since the first frame, offset, length
+TRAILER = struct.Struct("<QQ4s")  # index offset, frame count, index magic
+INDEX_MAGIC = b"LXIX"
+
+
+class LiveViewRecorder:
+    # Appends live view frames to a container file. Can be used directly as a
+    # LiveViewPipeline sink (decoder=None is enough).
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0))
+        self.index = []
+        self.first_timestamp = None
+
+    def __call__(self, frame, image=None):
+        self.record(frame)
+
+    def record(self, frame):
+        if self.first_timestamp is None:
+            self.first_timestamp = frame.timestamp
+        offset = self.file.tell()
+        self.file.write(frame.data)
+        self.index.append((frame.timestamp - self.first_timestamp, offset, len(frame.data)))
+
+    def close(self):
+        index_offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(TRAILER.pack(index_offset, len(self.index), INDEX_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LiveViewReplayer:
+    # Serves the frames of a recording through the same get_frame()/iteration interface
+    # as LiveViewReceiver. The file is memory-mapped and frames are memoryviews into it.
+    # speed scales the original timing (2.0 plays twice as fast); with speed=None every
+    # call returns the next frame right away, which gives a deterministic benchmark input.
+    def __init__(self, path, speed=1.0, loop=False):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception("{path} is not a live view recording".format(path=path))
+        index_offset, count, index_magic = TRAILER.unpack_from(self.map, len(self.map) - TRAILER.size)
+        if index_magic != INDEX_MAGIC:
+            raise Exception("{path} has no index, the recording was not closed properly".format(path=path))
+        self.index = [INDEX_ENTRY.unpack_from(self.map, index_offset + i * INDEX_ENTRY.size) for i in range(count)]
+        self.view = memoryview(self.map)
+        self.position = 0
+        self.sequence = 0
+        self.started = None
+        self.running = False
+        self.dropped = 0
+        self.malformed = 0
+        self.listeners = []
+
+    def __len__(self):
+        return len(self.index)
+
+    def duration(self):
+        return self.index[-1][0] if self.index else 0.0
+
+    def start(self):
+        self.started = time.monotonic()
+        self.position = 0
+        self.running = bool(self.index)
+        return self
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        self.stop()
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # Frames handed out are still referencing the map, it is unmapped once they are gone
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def due(self, position):
+        return self.started + self.index[position][0] / self.speed
+
+    def get_frame(self, timeout=None):
+        if not self.running:
+            return None
+        if self.position >= len(self.index):
+            if not self.loop:
+                self.running = False
+                return None
+            self.started = time.monotonic()
+            self.position = 0
+        if self.speed is not None:
+            now = time.monotonic()
+            wait = self.due(self.position) - now
+            if timeout is not None and wait > timeout:
+                time.sleep(timeout)
+                return None
+            if wait > 0:
+                time.sleep(wait)
+            # Like the live receiver, skip frames whose successor is already due
+            now = time.monotonic()
+            while self.position + 1 < len(self.index) and self.due(self.position + 1) <= now:
+                self.position += 1
+                self.dropped += 1
+        _, offset, length = self.index[self.position]
+        # Timestamps are on the monotonic clock like the receiver's: when the frame is due,
+        # or when it is served without pacing
+        timestamp = self.due(self.position) if self.speed is not None else time.monotonic()
+        frame = Frame(self.view[offset:offset + length], timestamp, self.sequence)
+        self.position += 1
+        self.sequence += 1
+        for listener in self.listeners:
+            listener(timestamp)
+        return frame
+
+    def __iter__(self):
+        while self.running:
+            frame = self.get_frame()
+            if frame is not None:
+                yield frame
+
+    def stats(self):
+        return {"frames": len(self.index), "served": self.sequence, "dropped": self.dropped}
@@ -0,0 +1,414 @@
+import io
+import os
+import queue
+import socket
+import statistics
+import threading
+import time
+from collections import deque
+
+JPEG_START = b'\xff\xd8'
+
+
+class Frame:
+    # One live view JPEG. `data` is a memoryview into the receiver's ring buffer: it stays
+    # valid until the next get_frame() call, use bytes() to keep the frame longer.
+    __slots__ = ("data", "timestamp", "sequence")
+
+    def __init__(self, data, timestamp, sequence):
+        self.data = data
+        self.timestamp = timestamp
+        self.sequence = sequence
+
+    def bytes(self):
+        return bytes(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+def find_jpeg(buffer, length):
+    # Return (start, end) of the JPEG in the first `length` bytes of buffer, or None.
+    # The camera prefixes each datagram with its own header before the SOI marker.
+    if length < 4 or buffer[length - 2] != 0xff or buffer[length - 1] != 0xd9:
+        return None
+    start = buffer.find(JPEG_START, 0, length)
+    if start < 0:
+        return None
+    return start, length
+
+
+class LiveViewReceiver:
+    # Receives the UDP live view stream on a background thread.
+    # Datagrams are read with recv_into into a preallocated ring of buffers, so no frame
+    # is copied, and consumers always get the newest complete frame: anything that
+    # arrived while they were busy is dropped instead of queued.
+    def __init__(self, port, host="0.0.0.0", ring_size=4, buffer_size=1024 * 512, timeout=1.0):
+        self.address = (host, port)
+        self.ring = [bytearray(buffer_size) for _ in range(max(ring_size, 3))]
+        self.timeout = timeout
+        self.socket = None
+        self.thread = None
+        self.running = False
+        self.condition = threading.Condition()
+        self.latest = None
+        self.latest_index = None
+        # Buffer holding the frame last handed to a consumer, never written to
+        self.in_use = None
+        self.sequence = 0
+        self.received = 0
+        self.malformed = 0
+        self.dropped = 0
+        self.timeouts = 0
+        self.last_receive = None
+        # Called with the timestamp of every complete frame, from the receiving thread
+        self.listeners = []
+
+    def start(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(self.address)
+        self.socket.settimeout(self.timeout)
+        self.running = True
+        self.thread = threading.Thread(target=self.receive_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+        with self.condition:
+            self.condition.notify_all()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def next_index(self, index):
+        index = (index + 1) % len(self.ring)
+        while index == self.in_use or index == self.latest_index:
+            index = (index + 1) % len(self.ring)
+        return index
+
+    def receive_loop(self):
+        index = 0
+        while self.running:
+            buffer = self.ring[index]
+            try:
+                length = self.socket.recv_into(buffer)
+            except socket.timeout:
+                self.timeouts += 1
+                continue
+            except OSError:
+                if self.running:
+                    raise
+                return
+            self.received += 1
+            self.last_receive = time.monotonic()
+            bounds = find_jpeg(buffer, length)
+            if bounds is None:
+                self.malformed += 1
+                continue
+            frame = Frame(memoryview(buffer)[bounds[0]:bounds[1]], self.last_receive, self.sequence)
+            self.sequence += 1
+            for listener in self.listeners:
+                listener(frame.timestamp)
+            with self.condition:
+                if self.latest is not None:
+                    # The previous frame was never picked up
+                    self.dropped += 1
+                self.latest = frame
+                self.latest_index = index
+                index = self.next_index(index)
+                self.condition.notify_all()
+
+    def get_frame(self, timeout=None):
+        # Wait for a frame newer than the last one returned, None on timeout or stop
+        with self.condition:
+            if self.latest is None:
+                self.condition.wait_for(lambda: self.latest is not None or not self.running, timeout)
+            frame = self.latest
+            if frame is not None:
+                self.in_use = self.latest_index
+                self.latest = None
+                self.latest_index = None
+            return frame
+
+    def __iter__(self):
+        while self.running:
+            frame = self.get_frame(self.timeout)
+            if frame is not None:
+                yield frame
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "malformed": self.malformed,
+            "dropped": self.dropped,
+            "timeouts": self.timeouts,
+        }
+
+
+class StreamSupervisor:
+    # Keeps a live view stream alive: sends getstate keepalives on its own timer,
+    # tracks the frame rate, jitter and gaps of the receiver, and restarts the stream
+    # (with exponential backoff) only when frames actually stop coming.
+    def __init__(self, camera, receiver, port, keepalive_interval=5.0, stall_timeout=3.0,
+                 gap_threshold=0.5, backoff=1.0, max_backoff=30.0, window=120):
+        self.camera = camera
+        self.receiver = receiver
+        self.port = port
+        self.keepalive_interval = keepalive_interval
+        self.stall_timeout = stall_timeout
+        self.gap_threshold = gap_threshold
+        self.initial_backoff = backoff
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.intervals = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.last_frame = None
+        self.frames = 0
+        self.gaps = 0
+        self.restarts = 0
+        self.keepalive_errors = 0
+        self.next_restart = 0.0
+        self.started = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.receiver.listeners.append(self.on_frame)
+        self.camera.start_stream(self.port)
+        self.started = time.monotonic()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.on_frame in self.receiver.listeners:
+            self.receiver.listeners.remove(self.on_frame)
+
+    def on_frame(self, timestamp):
+        with self.lock:
+            if self.last_frame is not None:
+                interval = timestamp - self.last_frame
+                self.intervals.append(interval)
+                if interval > self.gap_threshold:
+                    self.gaps += 1
+            self.last_frame = timestamp
+            self.frames += 1
+
+    def run(self):
+        last_keepalive = time.monotonic()
+        while self.running:
+            time.sleep(0.1)
+            now = time.monotonic()
+            if now - last_keepalive >= self.keepalive_interval:
+                last_keepalive = now
+                try:
+                    if not self.camera.get_state().ok:
+                        self.keepalive_errors += 1
+                except Exception:
+                    self.keepalive_errors += 1
+            last_frame = self.last_frame if self.last_frame is not None else self.started
+            if now - last_frame < self.stall_timeout:
+                self.backoff = self.initial_backoff
+                continue
+            if now >= self.next_restart:
+                self.restart()
+                self.next_restart = time.monotonic() + self.backoff
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def restart(self):
+        self.restarts += 1
+        try:
+            # The stream settings survive a stall, only startstream has to be sent again
+            self.camera.start_stream(self.port, configure=False)
+        except Exception:
+            pass
+
+    def stalled(self):
+        last_frame = self.last_frame if self.last_frame is not None else self.started
+        return last_frame is None or time.monotonic() - last_frame >= self.stall_timeout
+
+    def stats(self):
+        with self.lock:
+            intervals = list(self.intervals)
+        mean = sum(intervals) / len(intervals) if intervals else 0.0
+        return {
+            "frames": self.frames,
+            "fps": 1 / mean if mean else 0.0,
+            "jitter_ms": statistics.pstdev(intervals) * 1000 if len(intervals) > 1 else 0.0,
+            "gaps": self.gaps,
+            "malformed": self.receiver.malformed,
+            "dropped": self.receiver.dropped,
+            "restarts": self.restarts,
+            "keepalive_errors": self.keepalive_errors,
+            "stalled": self.stalled(),
+        }
+
+
+def decode_jpeg(data):
+    # Default decoder of LiveViewPipeline, Pillow is only needed when it is used
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+class StageMetrics:
+    __slots__ = ("count", "total_time", "max_time", "max_queue")
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.max_queue = 0
+
+    def record(self, duration, queue_depth=0):
+        self.count += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.max_queue = max(self.max_queue, queue_depth)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total_time / self.count * 1000 if self.count else 0.0,
+            "max_ms": self.max_time * 1000,
+            "max_queue": self.max_queue,
+        }
+
+
+def put_latest(stage_queue, item):
+    # Bounded queues drop their oldest entry instead of blocking the stage before them.
+    # Returns the number of entries dropped.
+    dropped = 0
+    while True:
+        try:
+            stage_queue.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                stage_queue.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+class LiveViewPipeline:
+    # Reader -> decoder pool -> sinks, connected by small bounded queues.
+    # `source` is anything with get_frame(timeout) (a LiveViewReceiver, a replayer, ...).
+    # Sinks are callables taking (frame, image); image is None when decoder is None,
+    # which is enough for sinks that only store the JPEG.
+    def __init__(self, source, sinks, decoder=decode_jpeg, workers=2, queue_size=2, timeout=1.0):
+        self.source = source
+        self.sinks = list(sinks)
+        self.decoder = decoder
+        self.workers = max(workers, 1)
+        self.timeout = timeout
+        self.decode_queue = queue.Queue(maxsize=queue_size)
+        self.render_queue = queue.Queue(maxsize=queue_size)
+        self.metrics = {"read": StageMetrics(), "decode": StageMetrics(), "render": StageMetrics()}
+        self.dropped = 0
+        self.last_rendered = -1
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self.read_loop, daemon=True)]
+        self.threads += [threading.Thread(target=self.decode_loop, daemon=True) for _ in range(self.workers)]
+        self.threads.append(threading.Thread(target=self.render_loop, daemon=True))
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def read_loop(self):
+        while self.running:
+            frame = self.source.get_frame(self.timeout)
+            if frame is None:
+                continue
+            started = time.perf_counter()
+            # The source may reuse its buffer on the next get_frame, the decoders need their own copy
+            frame = Frame(frame.bytes(), frame.timestamp, frame.sequence)
+            self.dropped += put_latest(self.decode_queue, frame)
+            self.metrics["read"].record(time.perf_counter() - started, self.decode_queue.qsize())
+
+    def decode_loop(self):
+        while self.running:
+            try:
+                frame = self.decode_queue.get(timeout=self.timeout)
+            except queue.Empty:
+                continue
+            started = time.perf_counter()
+            try:
+                image = self.decoder(frame.data) if self.decoder is not None else None
+            except Exception:
+                self.dropped += 1
+                continue
+            self.metrics["decode"].record(time.perf_counter() - started, self.decode_queue.qsize())
+            self.dropped += put_latest(self.render_queue, (frame, image))
+
+    def render_loop(self):
+        while self.running:
+            try:
+                frame, image = self.render_queue.get(timeout=self.timeout)
+            except queue.Empty:
+                continue
+            if frame.sequence <= self.last_rendered:
+                # A decoder finished an older frame after a newer one was shown
+                self.dropped += 1
+                continue
+            started = time.perf_counter()
+            for sink in self.sinks:
+                sink(frame, image)
+            self.last_rendered = frame.sequence
+            self.metrics["render"].record(time.perf_counter() - started, self.render_queue.qsize())
+
+    def stats(self):
+        stats = {name: metrics.as_dict() for name, metrics in self.metrics.items()}
+        stats["dropped"] = self.dropped
+        stats["decode_queue"] = self.decode_queue.qsize()
+        stats["render_queue"] = self.render_queue.qsize()
+        return stats
+
+
+class DirectorySink:
+    # Writes every frame as a numbered JPEG file
+    def __init__(self, directory, pattern="frame_{sequence:06d}.jpg"):
+        self.directory = directory
+        self.pattern = pattern
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, frame, image):
+        with open(os.path.join(self.directory, self.pattern.format(sequence=frame.sequence)), "wb") as f:
+            f.write(frame.data)
+
+
+class PipeSink:
+    # Writes the frames back to back as an MJPEG stream, e.g. to stdout for ffmpeg -f mjpeg -i -
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __call__(self, frame, image):
+        self.stream.write(frame.data)
+        self.stream.flush()
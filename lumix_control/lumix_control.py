@@ -1,311 +1,389 @@
-import requests as r
 import requests
-from urllib import request
-import xml.dom.minidom
-import http.client
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit
+import hashlib
+import os
+from . import content
+from . import exposure
+from .focus import FocusEngine
+from . import responses
+from .settings_cache import SettingsCache
+
+BROWSE_REQUEST = '''<?xml version="1.0" encoding="utf-8"?>
+    <s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
+    <s:Body>
+    <u:Browse xmlns:u="urn:schemas-upnp-org:service:ContentDirectory:1" xmlns:pana="urn:schemas-panasonic-com:pana">
+    <ObjectID>0</ObjectID>
+    <BrowseFlag>BrowseDirectChildren</BrowseFlag>
+    <Filter>*</Filter>
+    <StartingIndex>%d</StartingIndex>
+    <RequestedCount>%d</RequestedCount>
+    <SortCriteria></SortCriteria>
+    <pana:X_FromCP>LumixLink2.0</pana:X_FromCP>
+    </u:Browse>
+    </s:Body>
+    </s:Envelope>
+'''
+
+
+def hash_prefix(path, length, digest):
+    # Hash the first `length` bytes of path
+    hasher = hashlib.new(digest)
+    if length:
+        with open(path, "rb") as f:
+            while length > 0:
+                chunk = f.read(min(length, 1024 * 1024))
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                length -= len(chunk)
+    return hasher
+
+
+def part_source(url, size, date=None):
+    # What the .part.source file next to a partial download records about the camera file
+    return "{0}\n{1}\n{2}\n".format(url, size, date or "")
+
+
+def claim_part(part, source):
+    # A .part is only resumed if it was started for the same camera file: a leftover from
+    # a different file with the same name (a wrapped counter, another card) would be
+    # spliced into the new one. Parts without a .source file are started over too.
+    source_path = part + ".source"
+    try:
+        with open(source_path) as f:
+            known = f.read()
+    except FileNotFoundError:
+        known = None
+    if known != source:
+        if os.path.isfile(part):
+            os.remove(part)
+        with open(source_path, "w") as f:
+            f.write(source)
+
+
+def release_part(part):
+    try:
+        os.remove(part + ".source")
+    except FileNotFoundError:
+        pass
 
 
 class CameraControl:
-    def __init__(self, cam_ip):
+    def __init__(self, cam_ip, pool_size=4, timeout=5, retries=2, soap_port=60606, settings_ttl=30.0):
         self.cam_ip = cam_ip
         self.baseurl = "http://{ip}/cam.cgi".format(ip=self.cam_ip)
+        self.soap_url = "http://{host}:{port}/Server0/CDS_control".format(host=urlsplit(self.baseurl).hostname, port=soap_port)
+        self.timeout = timeout
+        # One keep-alive session for cam.cgi, the SOAP endpoint and file transfers.
+        # The camera's HTTP server is slow to accept connections, so they are reused.
+        # cam.cgi, the SOAP service and the file server are three host pools, all kept.
+        # Only connection failures are retried: a command whose reply got lost may
+        # already have run (e.g. a capture), so reads are never replayed.
+        self.session = requests.Session()
+        retry = Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=0.1)
+        adapter = HTTPAdapter(pool_connections=3, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.playmode = False
+        self.settings = SettingsCache(ttl=settings_ttl)
+        # Last get_lens_info reply, limits the apertures and shutter speeds set_* resolve to
+        self.lens = None
+        self.focus = None
         self.start_camera_control()
 
+    def request(self, params, timeout=None):
+        return self.session.get(self.baseurl, params=params, timeout=timeout or self.timeout)
+
+    def command(self, params, parse=responses.parse_reply, timeout=None):
+        # Send a cam.cgi request and parse the reply once, into the type `parse` makes
+        return parse(self.request(params, timeout).content)
+
     def start_camera_control(self):
-        resp = r.get(self.baseurl, params = {"mode": "camcmd", "value": "recmode"}, timeout=1)
-        if not self.check_response(resp):
+        reply = self.command({"mode": "camcmd", "value": "recmode"}, timeout=1)
+        if not self.check_response(reply):
             print ("Error starting camera control")
             raise Exception("Error starting camera control")
+        self.playmode = False
 
-    def start_stream(self, upd_port):
-        resp = r.get(self.baseurl, params = {"mode": "startstream", "value": str(upd_port)})
-        resp_2 = r.get(self.baseurl, params = {"mode": "setsetting", "type": "liveviewsize", "value": "vga"})
-        resp_3 = r.get(self.baseurl, params = {"mode": "camcmd", "value": "recmode"})
-        if self.check_response(resp) and self.check_response(resp_2) and self.check_response(resp_3):
+    def enter_playmode(self):
+        # The camera stays in playmode until something switches it back to recmode,
+        # so only send the command once per session.
+        if self.playmode:
+            return True
+        reply = self.command({"mode": "camcmd", "value": "playmode"})
+        if self.check_response(reply):
+            self.playmode = True
+        return self.playmode
+
+    def enter_recmode(self):
+        # Captures need recmode: switch back after browsing or downloading
+        if not self.playmode:
+            return True
+        reply = self.command({"mode": "camcmd", "value": "recmode"})
+        if self.check_response(reply):
+            self.playmode = False
+        return not self.playmode
+
+    def start_stream(self, upd_port, configure=True):
+        # configure=False only re-sends startstream, enough to restart a stream that was already set up
+        reply = self.command({"mode": "startstream", "value": str(upd_port)})
+        if not configure:
+            return reply.ok
+        reply_2 = self.command({"mode": "setsetting", "type": "liveviewsize", "value": "vga"})
+        reply_3 = self.command({"mode": "camcmd", "value": "recmode"})
+        self.playmode = False
+        if self.check_response(reply) and self.check_response(reply_2) and self.check_response(reply_3):
             return True
 
     def stop_stream(self):
-        resp = r.get(self.baseurl, params = {"mode": "stopstream"})
-        if self.check_response(resp):
+        reply = self.command({"mode": "stopstream"})
+        if self.check_response(reply):
             return True
 
     def get_state(self):
-        resp = r.get(self.baseurl, params = {"mode": "getstate"})
-        return resp
+        state = self.command({"mode": "getstate"}, responses.parse_state)
+        if self.settings.update_state(state):
+            # The lens may have been swapped
+            self.lens = None
+        return state
 
-    def get_info(self, setting):
+    def get_info(self, setting, parse=responses.parse_reply):
         params = {"mode": "getinfo", "type": setting}
-        resp = r.get(self.baseurl, params = params )
-        return resp
+        return self.command(params, parse)
 
     def current_menu_info(self):
-        resp = self.get_info("curmenu")
-        return resp
+        return self.get_info("curmenu")
 
     def all_menu_info(self):
-        resp = self.get_info("allmenu")
-        return resp
+        return self.get_info("allmenu")
 
     def get_lens_info(self):
-        # ?, max_fstop, min_fstop, max_shutter, min_shutter, ?, ?, max_zoom, min_zoom, ?, ?, ?
-        resp = self.get_info("lens")
-        return resp
+        lens = self.get_info("lens", responses.parse_lens_info)
+        self.lens = lens if lens.ok else None
+        return lens
+
+    def lens_limits(self):
+        # Cached lens info, None if the camera won't tell
+        if self.lens is None:
+            self.get_lens_info()
+        return self.lens
 
     def get_setting(self, setting):
+        cached = self.settings.get(setting, from_get=True)
+        if cached is not None:
+            return cached.response
         params = {"mode": "getsetting", "type": setting}
-        resp = r.get(self.baseurl, params = params )
-        return resp
+        reply = self.command(params, lambda data: responses.parse_setting(data, setting))
+        if reply.ok:
+            self.settings.put(setting, reply.value, reply, from_get=True)
+        return reply
+
+    def prefetch_settings(self, settings=("iso", "focal", "shtrspeed", "videoquality", "focusmode")):
+        # Fill the settings cache in one go, e.g. before re-applying an exposure preset
+        for setting in settings:
+            self.get_setting(setting)
 
     def get_focus_mode(self):
-        resp = self.get_setting("focusmode")
-        return resp
+        return self.get_setting("focusmode")
 
     def get_focus_mag(self):
-        resp = self.get_setting("mf_asst_mag")
-        return resp
+        return self.get_setting("mf_asst_mag")
 
     def get_mf_asst_setting(self):
-        resp = self.get_setting("mf_asst")
-        return resp
+        return self.get_setting("mf_asst")
 
     def set_setting(self, settings):
+        setting, value = settings.get("type"), settings.get("value")
+        if setting is not None and self.settings.holds(setting, value):
+            # The camera already has this value, answer with the reply that told us so
+            return self.settings.entries[setting].response
         params = {"mode": "setsetting"}
         params.update(settings)
-        resp = r.get(self.baseurl, params = params )
-        return resp
+        reply = self.command(params)
+        if setting is not None:
+            if reply.ok:
+                self.settings.put(setting, value, reply)
+            else:
+                self.settings.invalidate(setting)
+        return reply
 
     def set_iso(self, ISO):
-        if ISO == "auto":
-            ISO = "50"
-        resp = self.set_setting({"type": "iso", "value": ISO})
-        if self.check_response(resp):
-            print ("ISO set to " + ISO)
+        # Any number is rounded to the nearest third stop, "auto" for auto ISO
+        stop = exposure.iso_stop(ISO)
+        reply = self.set_setting({"type": "iso", "value": stop.value})
+        if self.check_response(reply):
+            print ("ISO set to " + stop.label)
 
     def set_focal(self, focal):
-        # 256 between full stops. The rest are third stops.
-        # See http://c710720.r20.cf2.rackcdn.com/wp-content/uploads/2011/08/ISO-Shutter-Speeds-Fstops-Copyright-2009-2011-photographyuncapped.gif
-        fstop = {
-        "1": "0/256",
-        "1.1": "85/256",
-        "1.2": "171/256",
-        "1.4": "256/256",
-        "1.6": "341/256",
-        "1.8": "427/256",
-        "2": "512/256",
-        "2.2": "597/256",
-        "2.4": "640/256",
-        "2.8": "768/256",
-        "3.2": "853/256",
-        "3.5": "939/256",
-        "4" : "1024/256",
-        "4.5": "1110/256",
-        "5": "1195/256",
-        "5.6": "1280/256",
-        "6.3": "1364/256",
-        "7.1": "1451/256",
-        "8": "1536/256",
-        "9": "1621/256",
-        "10": "1707/256",
-        "11": "1792/256",
-        "13": "1877/256",
-        "14": "1963/256",
-        "16": "2048/256",
-        "18": "2133/256",
-        "20": "2219/256",
-        "22": "2304/256"
-        }
-        resp = self.set_setting({"type": "focal", "value": fstop[focal] })
-        if self.check_response(resp):
-            print ("F Stop set to " + focal)
+        # Any f-number ("5.6", 5.5, "f/8") is rounded to the nearest stop the lens can do
+        stop = exposure.aperture_stop(focal, self.lens_limits())
+        reply = self.set_setting({"type": "focal", "value": stop.value})
+        if self.check_response(reply):
+            print ("F Stop set to " + stop.label)
 
     def set_shutter(self, shutter):
-        # 256 between full stops. 1 second is the pos/neg boundary
-        # See http://c710720.r20.cf2.rackcdn.com/wp-content/uploads/2011/08/ISO-Shutter-Speeds-Fstops-Copyright-2009-2011-photographyuncapped.gif
-        shutter_speed = {
-        "4000": "3072/256",
-        "3200": "2987/256",
-        "2500": "2902/256",
-        "2000": "2816/256",
-        "1600": "2731/256",
-        "1300": "2646/256",
-        "1000": "2560/256",
-        "800": "2475/256",
-        "640": "2390/256",
-        "500": "2304/256",
-        "400": "2219/256",
-        "320": "2134/256",
-        "250": "2048/256",
-        "200": "1963/256",
-        "160": "1878/256",
-        "125": "1792/256",
-        "100": "1707/256",
-        "80": "1622/256",
-        "60": "1536/256",
-        "50": "1451/256",
-        "40": "1366/256",
-        "30": "1280/256",
-        "25": "1195/256",
-        "20": "1110/256",
-        "15": "1024/256",
-        "13": "939/256",
-        "10": "854/256",
-        "8": "768/256",
-        "6": "683/256",
-        "5": "598/256",
-        "4": "512/256",
-        "3.2": "427/256",
-        "2.5": "342/256",
-        "2": "256/256",
-        "1.6": "171/256",
-        "1.3": "86/256",
-        "1": "0/256",
-        "1.3s": "-85/256",
-        "1.6s": "-170/256",
-        "2s": "-256/256",
-        "2.5s": "-341/256",
-        "3.2s": "-426/256",
-        "4s": "-512/256",
-        "5s": "-682/256",
-        "6s": "-768/256",
-        "8s": "-853/256",
-        "10s": "-938/256",
-        "13s": "-1024/256",
-        "15s": "-1109/256",
-        "20s": "-1194/256",
-        "25s": "-1280/256",
-        "30s": "-1365/256",
-        "40s": "-1450/256",
-        "50s": "-1536/256",
-        "60s": "16384/256",
-        "B": "256/256"  
-        }
-        resp = self.set_setting({"type": "shtrspeed", "value": shutter_speed[shutter] })
-        if self.check_response(resp):
-            print ("Shutter set to " + shutter)
+        # Strings are denominators ("250" for 1/250), seconds ("2s") or fractions ("1/250"),
+        # numbers are seconds: set_shutter(250) is 250 seconds and raises ValueError
+        stop = exposure.shutter_stop(shutter, self.lens_limits())
+        reply = self.set_setting({"type": "shtrspeed", "value": stop.value})
+        if self.check_response(reply):
+            print ("Shutter set to " + stop.label)
+
+    def apply_exposure(self, iso=None, shutter=None, aperture=None):
+        # Set any of the three at once. Values are resolved like in set_iso/set_shutter/set_focal,
+        # and settings the camera already has (according to the settings cache) are not sent.
+        # Returns {setting type: reply} for the settings that were given.
+        lens = self.lens_limits() if shutter is not None or aperture is not None else None
+        stops = []
+        if iso is not None:
+            stops.append(("iso", exposure.iso_stop(iso)))
+        if shutter is not None:
+            stops.append(("shtrspeed", exposure.shutter_stop(shutter, lens)))
+        if aperture is not None:
+            stops.append(("focal", exposure.aperture_stop(aperture, lens)))
+        return {setting: self.set_setting({"type": setting, "value": stop.value}) for setting, stop in stops}
 
     def set_video_quality(self, quality="mp4ed_30p_100mbps_4k"):
         # mp4_24p_100mbps_4k / mp4_30p_100mbps_4k
-        resp = self.set_setting({"type": "videoquality", "value": quality})
-        if self.check_response(resp):
+        reply = self.set_setting({"type": "videoquality", "value": quality})
+        if self.check_response(reply):
             print ("Video quality set to " + quality)
-        return resp
+        return reply
 
     def focus_control(self, direction="tele", speed="normal"):
         #tele or wide for direction, normal or fast for speed
         params = {"mode": "camctrl", "type": "focus", "value": "{0}-{1}".format(direction, speed)}
-        resp = r.get(self.baseurl, params = params )
-        return resp
-
-    def rack_focus(self, start_point="current", end_point="0", speed="normal"):
-        #tele or wide for direction, normal or fast for speed
-        
-        #Check where we are with a fine step
-        resp = self.focus_control("tele", "normal").text
-        current_position = int(resp.split(',')[1])
-        
-        if end_point == "current":
-            end_point = current_position + 13
-
-        # First get to the starting point if necessary
+        return self.command(params, responses.parse_focus_position)
+
+    def rack_focus(self, start_point="current", end_point="0", speed="normal", duration=None, easing="ease_in_out"):
+        # Pull focus from start_point to end_point. "fast" allows coarse steps, "normal" only uses fine ones.
+        # With a duration (seconds) the pull is spread over that time. Returns the (seconds, position) trace.
+        if self.focus is None:
+            self.focus = FocusEngine(self)
+        current_position = self.focus.read_position()
         if start_point == "current":
-            start_point = current_position + 13
-        elif int(start_point) < current_position:
-            while current_position - int(start_point) > 13:
-                resp = self.focus_control("tele", "fast").text
-                current_position = int(resp.split(',')[1])
-        else:
-            while int(start_point) - current_position > 13:
-                resp = self.focus_control("wide", "fast").text
-                current_position = int(resp.split(',')[1])
-
-        #At the start, now let's get to the end point
-        start_point = int(start_point)
-
-        threshold = 13
-        if speed == "fast":
-            threshold = 70
-
-        if start_point > int(end_point):
-            while current_position - int(end_point) > threshold:
-                resp = self.focus_control("tele", speed).text
-                current_position = int(resp.split(',')[1])
-                if current_position - int(end_point) <= threshold:
-                    #Fine focus for the last bit
-                    threshold = 13
-                    speed = "normal"
-        else:
-            while int(end_point) - current_position > threshold:
-                resp = self.focus_control("wide", speed).text
-                current_position = int(resp.split(',')[1])
-                if int(end_point) - current_position <= threshold:
-                    threshold = 13
-                    speed = "normal"
+            start_point = current_position
+        if end_point == "current":
+            end_point = current_position
+        return self.focus.rack(int(start_point), int(end_point), duration, easing, allow_fast=speed == "fast")
 
     def capture_photo(self):
-        params = {"mode": "camcmd", "value": "capture"}
-        resp = r.get(self.baseurl, params = params)
-        return resp
+        return self.command({"mode": "camcmd", "value": "capture"})
 
     def video_record_start(self):
-        params = {"mode": "camcmd", "value": "video_recstart"}
-        resp = r.get(self.baseurl, params = params)
-        return resp
+        return self.command({"mode": "camcmd", "value": "video_recstart"})
 
     def video_record_stop(self):
-        params = {"mode": "camcmd", "value": "video_recstop"}
-        resp = r.get(self.baseurl, params = params)
-        return resp
+        return self.command({"mode": "camcmd", "value": "video_recstop"})
 
     def get_picture_urls(self):
-        resp = r.get(self.baseurl, params = {"mode": "camcmd", "value": "playmode"})
-        resp_num_pics = r.get(self.baseurl, {"mode": "get_content_info"})
-        x = xml.dom.minidom.parseString(resp_num_pics.text)
-        num_pics = int(x.getElementsByTagName('total_content_number')[0].firstChild.nodeValue)
-        cam_ip = self.baseurl.split("/")[2]
-        soap_connection = http.client.HTTPConnection(cam_ip, 60606)
-        soap_data = '''<?xml version="1.0" encoding="utf-8"?>
-            <s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
-            <s:Body>
-            <u:Browse xmlns:u="urn:schemas-upnp-org:service:ContentDirectory:1" xmlns:pana="urn:schemas-panasonic-com:pana">
-            <ObjectID>0</ObjectID>
-            <BrowseFlag>BrowseDirectChildren</BrowseFlag>
-            <Filter>*</Filter>
-            <StartingIndex>%d</StartingIndex>
-            <RequestedCount>%d</RequestedCount>
-            <SortCriteria></SortCriteria>
-            <pana:X_FromCP>LumixLink2.0</pana:X_FromCP>
-            </u:Browse>
-            </s:Body>
-            </s:Envelope>
-        ''' % (0, num_pics)
+        return [entry.url for entry in self.get_pictures()]
+
+    def get_pictures(self):
+        return list(self.iter_pictures())
+
+    def get_content_count(self):
+        resp = self.request({"mode": "get_content_info"})
+        return content.parse_content_count(resp.content)
+
+    def iter_pictures(self, batch_size=500, start=0):
+        # Page through the ContentDirectory so the camera never has to build one huge
+        # response, and callers can start working on the first page right away.
+        self.enter_playmode()
+        num_pics = self.get_content_count()
+        while start < num_pics:
+            page = self.browse(start, min(batch_size, num_pics - start))
+            if page.number_returned == 0:
+                break
+            start += page.number_returned
+            num_pics = min(num_pics, page.total_matches or num_pics)
+            yield from content.iter_didl(page.didl)
+
+    def browse(self, start, count):
+        soap_data = BROWSE_REQUEST % (start, count)
         soap_headers = {
             'Content-Type': 'text/xml; charset="UTF-8"',
-            'Content-Length': len(soap_data),
             'SOAPACTION': 'urn:schemas-upnp-org:service:ContentDirectory:1#Browse',
         }
-        soap_connection.request('POST', '/Server0/CDS_control', soap_data, soap_headers)
-        resp = soap_connection.getresponse()
-        x = xml.dom.minidom.parseString(resp.read())
-        return [res.firstChild.nodeValue for res in xml.dom.minidom.parseString(x.getElementsByTagName('Result')[0].firstChild.nodeValue).getElementsByTagName('res')]
-
-    def download_picture(self, url, dest):
-        r.get(self.baseurl, params = {"mode": "camcmd", "value": "playmode"})
-        request.urlretrieve(url, dest)
+        with self.session.post(self.soap_url, data=soap_data.encode(), headers=soap_headers, stream=True, timeout=self.timeout) as resp:
+            resp.raise_for_status()
+            resp.raw.decode_content = True
+            return content.parse_browse_response(resp.raw)
+
+    def download_picture(self, url, dest, size=None, chunk_size=1024 * 256, retries=3, digest=None, date=None):
+        # Stream into dest.part and only move it into place once it is complete,
+        # so an interrupted transfer can be resumed instead of restarted.
+        # The url, size and date (from the listing) are recorded next to the part,
+        # see claim_part.
+        # With digest (a hashlib name), the data is hashed as it is written and the hex
+        # digest of the complete file is returned.
+        self.enter_playmode()
+        if size is None:
+            size = self.get_remote_size(url)
+        part = dest + ".part"
+        claim_part(part, part_source(url, size, date))
+        hasher = None
+        for attempt in range(retries + 1):
+            offset = os.path.getsize(part) if os.path.isfile(part) else 0
+            if offset > size:
+                # Leftover from a different file with the same name
+                os.remove(part)
+                offset = 0
+            if digest is not None and hasher is None:
+                # Only a resumed download has to read back what is already on disk
+                hasher = hash_prefix(part, offset, digest)
+            if offset < size or not os.path.isfile(part):
+                try:
+                    hasher = self.download_range(url, part, offset, chunk_size, hasher)
+                except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                    # Part of the chunk may have been hashed but not written
+                    hasher = None
+                    if attempt == retries:
+                        raise
+                    continue
+            if os.path.getsize(part) == size:
+                os.replace(part, dest)
+                release_part(part)
+                return hasher.hexdigest() if hasher is not None else None
+            if os.path.getsize(part) > size:
+                os.remove(part)
+                hasher = None
+        raise Exception("Downloaded size of {url} does not match the camera's X-FILE_SIZE".format(url=url))
+
+    def download_range(self, url, part, offset, chunk_size, hasher=None):
+        # Returns the hasher that covers the whole part file
+        headers = {"Range": "bytes={0}-".format(offset)} if offset else {}
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as resp:
+            resp.raise_for_status()
+            if offset and resp.status_code != 206:
+                # The camera ignored the Range header and is sending the whole file
+                offset = 0
+                if hasher is not None:
+                    hasher = hashlib.new(hasher.name)
+            with open(part, "ab" if offset else "wb") as f:
+                for chunk in resp.iter_content(chunk_size):
+                    f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+        return hasher
 
     def get_remote_size(self, url):
-        head = requests.head(url)
+        head = self.session.head(url, timeout=self.timeout)
         return int(head.headers["X-FILE_SIZE"])
 
-    def check_response(self, resp):
-        # Get a 200 response even on error. Have to check <result>
-        if "<result>ok</result>" in resp.text:
+    def check_response(self, reply):
+        # The camera answers 200 even on error, the parsed <result> tells
+        if reply.ok:
             return True
         else:
-            print (resp.text)
+            print (reply.text)
             return False
     
     def close(self):
-        del self
+        if self.focus is not None:
+            self.focus.close()
+        self.session.close()
 
 if __name__ == "__main__":
     IP = "10.0.1.105"
@@ -0,0 +1,379 @@
+import argparse
+import io
+import random
+import re
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+from . import colors
+
+# Relative frequency and size range (bytes) of each kind of file on the mock card
+DEFAULT_FILE_MIX = {
+    "JPG": (6, 4 * 1024 * 1024, 9 * 1024 * 1024),
+    "RAW": (3, 18 * 1024 * 1024, 22 * 1024 * 1024),
+    "MP4": (1, 50 * 1024 * 1024, 400 * 1024 * 1024),
+}
+MIME_TYPES = {"JPG": "image/jpeg", "RAW": "image/x-panasonic-rw2", "MP4": "video/mp4"}
+THUMBNAIL_SIZE = 8 * 1024
+PREVIEW_SIZE = 120 * 1024
+DATA_BLOCK_SIZE = 64 * 1024
+
+
+def frame_send_time(data):
+    # Monotonic time at which the mock sent a live view frame, None for other frames
+    if bytes(data[2:4]) != b'\xff\xfe':
+        return None
+    return struct.unpack_from(">d", data, 6)[0]
+
+
+def make_jpeg(size=(640, 480)):
+    # A real JPEG if Pillow is installed, otherwise just the markers the receiver looks for
+    try:
+        from PIL import Image
+    except ImportError:
+        return b'\xff\xd8' + bytes(30 * 1024) + b'\xff\xd9'
+    output = io.BytesIO()
+    Image.new("RGB", size, (90, 120, 150)).save(output, "JPEG", quality=80)
+    return output.getvalue()
+
+
+class MockItem:
+    __slots__ = ("number", "kind", "size", "date")
+
+    def __init__(self, number, kind, size, date):
+        self.number = number
+        self.kind = kind
+        self.size = size
+        self.date = date
+
+    def resources(self):
+        # (name, size, mime type) of the original, the large preview and the thumbnail
+        return [
+            ("DO{0}.{1}".format(self.number, self.kind), self.size, MIME_TYPES[self.kind]),
+            ("DL{0}.JPG".format(self.number), PREVIEW_SIZE, "image/jpeg"),
+            ("DT{0}.JPG".format(self.number), THUMBNAIL_SIZE, "image/jpeg"),
+        ]
+
+
+class MockCamera:
+    # Local stand-in for a GX80: cam.cgi commands, the ContentDirectory SOAP service,
+    # file downloads and the UDP live view stream.
+    # latency (seconds) is added before every HTTP reply, bandwidth (bytes/s) throttles
+    # downloads (one link shared by all connections, like the camera's Wi-Fi), and packet_loss is the probability of dropping a live view datagram.
+    #
+    #     with MockCamera(card_size=500) as mock:
+    #         camera = CameraControl(mock.cam_ip, soap_port=mock.soap_port)
+    def __init__(self, host="127.0.0.1", port=0, soap_port=0, latency=0.0, bandwidth=None,
+                 packet_loss=0.0, card_size=100, file_mix=None, fps=30, seed=0):
+        self.host = host
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.packet_loss = packet_loss
+        self.fps = fps
+        self.random = random.Random(seed)
+        self.file_mix = file_mix or DEFAULT_FILE_MIX
+        self.block = bytes(self.random.getrandbits(8) for _ in range(DATA_BLOCK_SIZE))
+        self.items = []
+        self.lock = threading.Lock()
+        # Time at which the link is done sending everything booked so far
+        self.link_lock = threading.Lock()
+        self.link_free = 0.0
+        for _ in range(card_size):
+            self.add_item()
+        self.settings = {"iso": "200", "focal": "1280/256", "shtrspeed": "2048/256", "videoquality": "mp4_30p_100mbps_4k", "focusmode": "mf"}
+        self.focus_position = 512
+        self.mode = "recmode"
+        self.recording = False
+        self.requests = 0
+        self.stream_target = None
+        self.stream_thread = None
+        self.frame = make_jpeg()
+        self.http = MockHTTPServer((host, port), CameraHandler, self)
+        self.soap = MockHTTPServer((host, soap_port), SoapHandler, self)
+        self.threads = []
+
+    @property
+    def port(self):
+        return self.http.server_address[1]
+
+    @property
+    def soap_port(self):
+        return self.soap.server_address[1]
+
+    @property
+    def cam_ip(self):
+        # Value to pass to CameraControl
+        return "{0}:{1}".format(self.host, self.port)
+
+    def add_item(self):
+        with self.lock:
+            kinds = list(self.file_mix)
+            kind = self.random.choices(kinds, weights=[self.file_mix[k][0] for k in kinds])[0]
+            _, low, high = self.file_mix[kind]
+            number = 1000 + len(self.items)
+            date = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(1600000000 + number * 60))
+            item = MockItem(number, kind, self.random.randint(low, high), date)
+            self.items.append(item)
+            return item
+
+    def find_resource(self, name):
+        match = re.fullmatch(r"D[OLT](\d+)\.\w+", name)
+        if match is None:
+            return None
+        index = int(match.group(1)) - 1000
+        if not 0 <= index < len(self.items):
+            return None
+        for resource in self.items[index].resources():
+            if resource[0] == name:
+                return resource
+        return None
+
+    def read(self, offset, length):
+        # File contents are the same pseudo random block repeated, nothing is stored
+        start = offset % DATA_BLOCK_SIZE
+        data = self.block[start:] + self.block * (length // DATA_BLOCK_SIZE + 1)
+        return data[:length]
+
+    def throttle(self, length):
+        # Token bucket without burst, shared by all connections: every chunk books its
+        # transfer time on the link and waits for it, so N parallel downloads split the
+        # bandwidth instead of getting N times as much.
+        if not self.bandwidth:
+            return
+        with self.link_lock:
+            self.link_free = max(self.link_free, time.monotonic()) + length / self.bandwidth
+            due = self.link_free
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def start(self):
+        for server in (self.http, self.soap):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        self.stop_stream()
+        for server in (self.http, self.soap):
+            server.shutdown()
+            server.server_close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start_stream(self, address):
+        self.stream_target = address
+        if self.stream_thread is None:
+            self.stream_thread = threading.Thread(target=self.stream_loop, daemon=True)
+            self.stream_thread.start()
+
+    def stop_stream(self):
+        self.stream_target = None
+        if self.stream_thread is not None:
+            self.stream_thread.join()
+            self.stream_thread = None
+
+    def stream_loop(self):
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # The camera puts its own header in front of the JPEG
+        header = b"\x00" * 32
+        next_frame = time.monotonic()
+        while self.stream_target is not None:
+            if self.random.random() >= self.packet_loss:
+                # A JPEG comment segment right after SOI carries the send time, for latency measurements
+                comment = b'\xff\xfe' + struct.pack(">Hd", 10, time.monotonic())
+                try:
+                    sender.sendto(header + self.frame[:2] + comment + self.frame[2:], self.stream_target)
+                except OSError:
+                    pass
+            next_frame += 1 / self.fps
+            time.sleep(max(next_frame - time.monotonic(), 0))
+        sender.close()
+
+    def browse_result(self, start, count):
+        items = self.items[start:start + count]
+        didl = ['<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/">']
+        for item in items:
+            didl.append('<item id="{0}" parentID="0" restricted="1"><dc:title>P{0}</dc:title><dc:date>{1}</dc:date>'.format(item.number, item.date))
+            for name, size, mime_type in item.resources():
+                didl.append('<res protocolInfo="http-get:*:{0}:*" size="{1}">http://{2}/{3}</res>'.format(mime_type, size, self.cam_ip, name))
+            didl.append('</item>')
+        didl.append('</DIDL-Lite>')
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>'
+            '<u:BrowseResponse xmlns:u="urn:schemas-upnp-org:service:ContentDirectory:1">'
+            '<Result>{0}</Result><NumberReturned>{1}</NumberReturned><TotalMatches>{2}</TotalMatches><UpdateID>1</UpdateID>'
+            '</u:BrowseResponse></s:Body></s:Envelope>'
+        ).format(escape("".join(didl)), len(items), len(self.items))
+
+    def command(self, params, client_host):
+        # Reply to a cam.cgi request
+        self.requests += 1
+        mode = params.get("mode")
+        value = params.get("value")
+        ok = "<?xml version=\"1.0\" encoding=\"UTF-8\"?><camrply><result>ok</result>{0}</camrply>"
+        if mode == "camcmd":
+            if value in ("recmode", "playmode"):
+                self.mode = value
+            elif value == "capture":
+                self.add_item()
+            elif value in ("video_recstart", "video_recstop"):
+                self.recording = value == "video_recstart"
+                if value == "video_recstop":
+                    self.add_item()
+            else:
+                return ok.replace("ok", "err_param", 1).format("")
+            return ok.format("")
+        if mode == "getstate":
+            return ok.format(
+                "<state><batt>3/3</batt><cammode>{0}</cammode><sdcardstatus>write_enable</sdcardstatus>"
+                "<sd_memory>set</sd_memory><sd_access>off</sd_access><rec>{1}</rec>"
+                "<remaincapacity>{2}</remaincapacity><version>mock</version></state>".format(
+                    self.mode, "on" if self.recording else "off", 9999 - len(self.items)))
+        if mode == "getinfo":
+            if params.get("type") == "lens":
+                return "ok,2304/256,768/256,3072/256,-1536/256,0,on,42,14,on,128/1024,on"
+            return ok.format("<menuset></menuset>")
+        if mode == "getsetting":
+            setting = params.get("type")
+            return ok.format('<settingvalue {0}="{1}"></settingvalue>'.format(setting, escape(self.settings.get(setting, ""))))
+        if mode == "setsetting":
+            self.settings[params.get("type")] = value
+            return ok.format("")
+        if mode == "camctrl" and params.get("type") == "focus":
+            direction, _, speed = (value or "").partition("-")
+            step = 70 if speed == "fast" else 13
+            self.focus_position += step if direction == "wide" else -step
+            self.focus_position = max(0, min(1023, self.focus_position))
+            return "ok,{0},1023".format(self.focus_position)
+        if mode == "get_content_info":
+            return ok.format("<current_position>{0}</current_position><total_content_number>{0}</total_content_number>"
+                             "<content_number>{0}</content_number>".format(len(self.items)))
+        if mode == "startstream":
+            self.start_stream((client_host, int(value)))
+            return ok.format("")
+        if mode == "stopstream":
+            self.stop_stream()
+            return ok.format("")
+        return ok.replace("ok", "err_param", 1).format("")
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, camera):
+        super().__init__(address, handler)
+        self.camera = camera
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send headers and body together, otherwise Nagle's algorithm adds ~40ms to every reply
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        colors.debug(format % args)
+
+    def reply(self, body, status=200, headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        time.sleep(self.server.camera.latency)
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class CameraHandler(MockHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/cam.cgi":
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            self.reply(self.server.camera.command(params, self.client_address[0]), headers={"Content-Type": "text/xml"})
+            return
+        self.send_file(url.path.lstrip("/"))
+
+    def do_HEAD(self):
+        self.send_file(urlsplit(self.path).path.lstrip("/"))
+
+    def send_file(self, name):
+        camera = self.server.camera
+        resource = camera.find_resource(name)
+        if resource is None:
+            self.reply(b"", status=404)
+            return
+        _, size, mime_type = resource
+        start = 0
+        status = 200
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match is not None and int(match.group(1)) < size:
+            start = int(match.group(1))
+            status = 206
+        time.sleep(camera.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", mime_type)
+        self.send_header("Content-Length", str(size - start))
+        self.send_header("X-FILE_SIZE", str(size))
+        if status == 206:
+            self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(start, size - 1, size))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        # Small chunks so parallel downloads interleave on the shared link
+        chunk_size = 64 * 1024
+        for offset in range(start, size, chunk_size):
+            data = camera.read(offset, min(chunk_size, size - offset))
+            camera.throttle(len(data))
+            self.wfile.write(data)
+
+
+class SoapHandler(MockHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        start = re.search(r"<StartingIndex>(\d+)</StartingIndex>", body)
+        count = re.search(r"<RequestedCount>(\d+)</RequestedCount>", body)
+        if start is None or count is None:
+            self.reply("", status=500)
+            return
+        self.reply(self.server.camera.browse_result(int(start.group(1)), int(count.group(1))), headers={"Content-Type": "text/xml; charset=\"utf-8\""})
+
+
+def make_parser(mock_parser: argparse.ArgumentParser):
+    mock_parser.add_argument('-v', '--verbose', action='store_true', help='Print every request')
+    mock_parser.add_argument('--host', help='Address to listen on', default='127.0.0.1', type=str)
+    mock_parser.add_argument('-p', '--port', help='cam.cgi and download port', default=8080, type=int)
+    mock_parser.add_argument('--soap-port', help='ContentDirectory port', default=60606, type=int)
+    mock_parser.add_argument('--latency', help='Delay added to every HTTP reply, in seconds', default=0.0, type=float)
+    mock_parser.add_argument('--bandwidth', help='Download bandwidth limit in bytes per second', default=None, type=float)
+    mock_parser.add_argument('--packet-loss', help='Probability of dropping a live view datagram', default=0.0, type=float)
+    mock_parser.add_argument('--card-size', help='Number of items on the card', default=100, type=int)
+
+
+def main(args):
+    colors.verbose = args.verbose
+    mock = MockCamera(args.host, args.port, args.soap_port, args.latency, args.bandwidth, args.packet_loss, args.card_size).start()
+    colors.info(f'Mock camera listening on {mock.cam_ip} (ContentDirectory on port {mock.soap_port})')
+    colors.info(f'Use it with: lumix-control copy wifi -i {mock.cam_ip} --soap-port {mock.soap_port} -o OUTPUT')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock.stop()
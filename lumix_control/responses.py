@@ -0,0 +1,228 @@
+import xml.parsers.expat
+
+# getstate fields that change on their own (battery, card activity, ...)
+# and say nothing about the camera's settings.
+VOLATILE_STATE_FIELDS = {
+    "batt", "remaincapacity", "video_remaincapacity", "sd_access", "sd2_access",
+    "temperature", "progress_time", "sd_memory", "sd2_memory",
+}
+
+
+class Reply:
+    # A cam.cgi reply. result is "ok" or the camera's error code (err_param, err_busy, ...),
+    # None if the reply could not be parsed at all. text is kept for error messages.
+    __slots__ = ("result", "text")
+
+    def __init__(self, result, text=None):
+        self.result = result
+        self.text = text
+
+    @property
+    def ok(self):
+        return self.result == "ok"
+
+    def __repr__(self):
+        return "{0}({1!r})".format(type(self).__name__, self.result)
+
+
+class CameraState(Reply):
+    # Reply to getstate: the leaf elements of <state>, e.g. {"batt": "3/3", "cammode": "rec"}
+    __slots__ = ("fields",)
+
+    def __init__(self, result, text=None, fields=None):
+        super().__init__(result, text)
+        self.fields = fields or {}
+
+    def get(self, name, default=None):
+        return self.fields.get(name, default)
+
+    @property
+    def battery(self):
+        return self.fields.get("batt")
+
+    @property
+    def mode(self):
+        return self.fields.get("cammode")
+
+    @property
+    def recording(self):
+        return self.fields.get("rec") == "on"
+
+    @property
+    def remaining_capacity(self):
+        value = self.fields.get("remaincapacity")
+        return int(value) if value and value.lstrip("-").isdigit() else None
+
+    def signature(self):
+        # Everything that only changes when the camera's settings do
+        return tuple(sorted((name, value) for name, value in self.fields.items() if name not in VOLATILE_STATE_FIELDS))
+
+
+class Setting(Reply):
+    # Reply to getsetting: <settingvalue iso="200"/>
+    __slots__ = ("type", "value")
+
+    def __init__(self, result, text=None, type=None, value=None):
+        super().__init__(result, text)
+        self.type = type
+        self.value = value
+
+    def __repr__(self):
+        return "Setting({0!r}, {1!r}={2!r})".format(self.result, self.type, self.value)
+
+
+class LensInfo(Reply):
+    # Reply to getinfo type=lens, a CSV line:
+    # ok, max aperture, min aperture, max shutter, min shutter, ?, ?, max zoom, min zoom, ?, ?, ?
+    # Apertures and shutter speeds are APEX values (Av, Tv) written as fractions, e.g. 768/256.
+    __slots__ = ("max_aperture", "min_aperture", "max_shutter", "min_shutter", "max_zoom", "min_zoom", "values")
+
+    def __init__(self, result, text=None, values=()):
+        super().__init__(result, text)
+        self.values = tuple(values)
+        self.max_aperture = parse_fraction(self.field(0))
+        self.min_aperture = parse_fraction(self.field(1))
+        self.max_shutter = parse_fraction(self.field(2))
+        self.min_shutter = parse_fraction(self.field(3))
+        self.max_zoom = parse_int(self.field(6))
+        self.min_zoom = parse_int(self.field(7))
+
+    def field(self, i):
+        return self.values[i] if i < len(self.values) else None
+
+    def __repr__(self):
+        return "LensInfo({0!r}, aperture={1!r}..{2!r}, shutter={3!r}..{4!r}, zoom={5!r}..{6!r})".format(
+            self.result, self.min_aperture, self.max_aperture, self.min_shutter, self.max_shutter, self.min_zoom, self.max_zoom)
+
+
+class FocusPosition(Reply):
+    # Reply to camctrl type=focus: "ok,<position>,<maximum>"
+    __slots__ = ("position", "maximum")
+
+    def __init__(self, result, text=None, position=None, maximum=None):
+        super().__init__(result, text)
+        self.position = position
+        self.maximum = maximum
+
+    def __repr__(self):
+        return "FocusPosition({0!r}, {1!r}/{2!r})".format(self.result, self.position, self.maximum)
+
+
+def parse_fraction(text):
+    if not text:
+        return None
+    numerator, _, denominator = text.partition("/")
+    try:
+        return int(numerator) / int(denominator) if denominator else float(numerator)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def parse_int(text):
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+
+class ReplyParser:
+    # Incremental parser for the XML replies: feed() it chunks, close() returns
+    # (result, leaf element texts, leaf element attributes). expat callbacks collect the
+    # leaves in one pass, no element tree is built. The callbacks are closures rather
+    # than methods, which roughly halves the cost of a getstate reply.
+    def __init__(self):
+        fields = self.fields = {}
+        attributes = self.attributes = {}
+        leaf = [None, ""]  # element being read and its text
+
+        def start(name, element_attributes):
+            leaf[0] = name
+            leaf[1] = ""
+            if element_attributes:
+                attributes[name] = element_attributes
+
+        def data(text):
+            leaf[1] += text
+
+        def end(name):
+            # Only elements without children are kept: a parent's end comes after a child's
+            if leaf[0] == name:
+                fields[name] = leaf[1]
+            leaf[0] = None
+
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = start
+        self.parser.EndElementHandler = end
+        self.parser.CharacterDataHandler = data
+
+    def feed(self, data):
+        self.parser.Parse(data, False)
+
+    def close(self):
+        self.parser.Parse(b"", True)
+        return self.fields.pop("result", None), self.fields, self.attributes
+
+
+def decode(data):
+    return data.decode("utf-8", errors="replace") if isinstance(data, bytes) else data
+
+
+def parse_xml(data):
+    parser = ReplyParser()
+    try:
+        parser.feed(data)
+        return parser.close()
+    except xml.parsers.expat.ExpatError:
+        return None, {}, {}
+
+
+def is_xml(text):
+    return text.lstrip()[:1] == "<"
+
+
+def parse_result(text):
+    # <result> is all a plain reply carries: slice it out instead of running the parser
+    start = text.find("<result>")
+    end = text.find("</result>", start)
+    if start < 0 or end < 0:
+        return parse_xml(text)[0]
+    return text[start + len("<result>"):end].strip()
+
+
+def parse_reply(data):
+    # Plain command replies (camcmd, setsetting, ...)
+    text = decode(data)
+    if not is_xml(text):
+        return Reply(text.strip().split(",", 1)[0] or None, text)
+    return Reply(parse_result(text), text)
+
+
+def parse_state(data):
+    text = decode(data)
+    result, fields, _ = parse_xml(data)
+    return CameraState(result, text, fields)
+
+
+def parse_setting(data, setting_type):
+    text = decode(data)
+    result, _, attributes = parse_xml(data)
+    return Setting(result, text, setting_type, attributes.get("settingvalue", {}).get(setting_type))
+
+
+def parse_lens_info(data):
+    text = decode(data)
+    if is_xml(text):
+        # Errors come back as XML
+        return LensInfo(parse_result(text), text)
+    values = text.strip().split(",")
+    return LensInfo(values[0] or None, text, values[1:])
+
+
+def parse_focus_position(data):
+    text = decode(data)
+    if is_xml(text):
+        return FocusPosition(parse_result(text), text)
+    values = text.strip().split(",")
+    return FocusPosition(values[0] or None, text, parse_int(values[1]) if len(values) > 1 else None,
+                         parse_int(values[2]) if len(values) > 2 else None)
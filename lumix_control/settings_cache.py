@@ -0,0 +1,73 @@
+import time
+
+
+class CachedSetting:
+    __slots__ = ("value", "response", "from_get", "timestamp")
+
+    def __init__(self, value, response, from_get, timestamp):
+        self.value = value
+        self.response = response
+        # Only a getsetting reply can be handed back in place of a getsetting request
+        self.from_get = from_get
+        self.timestamp = timestamp
+
+
+class SettingsCache:
+    # Last known value of each setting type, so unchanged settings are not re-sent
+    # and getters don't hit the camera for every call.
+    # Entries expire after ttl seconds, and all of them are dropped when getstate
+    # shows the camera changed (mode dial, lens, ...).
+    def __init__(self, ttl=30.0):
+        self.ttl = ttl
+        self.entries = {}
+        self.state = None
+        self.hits = 0
+        self.misses = 0
+        self.skipped_writes = 0
+
+    def get(self, setting_type, from_get=False):
+        # With from_get, only entries holding a getsetting reply count
+        entry = self.entries.get(setting_type)
+        if entry is not None and time.monotonic() - entry.timestamp > self.ttl:
+            del self.entries[setting_type]
+            entry = None
+        if entry is not None and from_get and not entry.from_get:
+            entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, setting_type, value, response=None, from_get=False):
+        self.entries[setting_type] = CachedSetting(value, response, from_get, time.monotonic())
+
+    def holds(self, setting_type, value):
+        # True if the camera is known to already have this value, in which case the write can be skipped
+        entry = self.get(setting_type)
+        if entry is not None and entry.value == value:
+            self.skipped_writes += 1
+            return True
+        return False
+
+    def invalidate(self, setting_type=None):
+        if setting_type is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(setting_type, None)
+
+    def update_state(self, state):
+        # Called with each getstate reply (a CameraState); drops every entry if the camera state
+        # changed. Returns True in that case.
+        if not state.ok:
+            return False
+        signature = state.signature()
+        changed = self.state is not None and signature != self.state
+        if changed:
+            self.invalidate()
+        self.state = signature
+        return changed
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "skipped_writes": self.skipped_writes, "entries": len(self.entries)}
+
@@ -0,0 +1,164 @@
+import argparse
+import os
+import time
+
+from . import colors
+from .copy import place_file
+from .copy.index import TransferIndex
+from .lumix_control import CameraControl
+
+
+class IngestReport:
+    # One file brought in by Tether. latency is the time from the capture (or from the
+    # moment the file showed up, for shots taken on the camera body) to the file on disk.
+    __slots__ = ("entry", "path", "size", "latency")
+
+    def __init__(self, entry, path, size, latency):
+        self.entry = entry
+        self.path = path
+        self.size = size
+        self.latency = latency
+
+    def __repr__(self):
+        return "IngestReport({0!r}, {1:.0f}ms)".format(os.path.basename(self.path), self.latency * 1000)
+
+
+def item_key(entry):
+    # The original, large preview and thumbnail of an item share its content ID (and number)
+    return entry.object_id if entry.object_id is not None else entry.name[2:].split(".")[0]
+
+
+def is_jpeg(entry):
+    return entry.mime_type == "image/jpeg" or entry.name.upper().endswith((".JPG", ".JPEG"))
+
+
+class Tether:
+    # Downloads new captures as soon as they appear on the card.
+    # Only the content count is polled; when it grows, only the new tail of the
+    # ContentDirectory is browsed. With jpeg_first, the JPEGs of a batch are downloaded
+    # before the RAWs so a preview is on disk as early as possible.
+    # Files are named and added to the output directory's transfer index like `copy wifi`
+    # does, so a later copy does not download them again. if_exists decides what happens
+    # to a different file that already has the name, like `copy -x`.
+    def __init__(self, camera, output, jpeg_first=True, use_index=True, if_exists="rename"):
+        self.camera = camera
+        self.output = output
+        self.jpeg_first = jpeg_first
+        self.if_exists = if_exists
+        os.makedirs(output, exist_ok=True)
+        self.index = TransferIndex(output) if use_index else None
+        self.seen = camera.get_content_count()
+        self.reports = []
+
+    def poll(self, since=None):
+        # Download whatever appeared since the last poll. since is the monotonic time the
+        # latencies are measured from, by default the moment the new files were noticed.
+        count = self.camera.get_content_count()
+        if count < self.seen:
+            # Pictures were deleted on the camera: what is left was already seen
+            self.seen = count
+            return []
+        if count == self.seen:
+            return []
+        since = time.monotonic() if since is None else since
+        # The listing may include shots taken after the count was read, so seen advances
+        # by the number of items actually browsed, not to count
+        entries = []
+        items = set()
+        for entry in self.camera.iter_pictures(start=self.seen):
+            items.add(item_key(entry))
+            if entry.name.startswith("DO"):
+                entries.append(entry)
+        if self.jpeg_first:
+            entries.sort(key=lambda entry: not is_jpeg(entry))
+        reports = []
+        existing = {file.name: file for file in os.scandir(self.output) if file.is_file()}
+        for entry in entries:
+            size = entry.size if entry.size is not None else self.camera.get_remote_size(entry.url)
+            key = entry.index_key(size)
+            if self.index is not None and key in self.index:
+                continue
+            path, copied_as = place_file(entry, os.path.join(self.output, entry.local_name), size, None, self.if_exists, existing, colors.debug)
+            if path is None:
+                if copied_as is not None and self.index is not None:
+                    self.index.add(key, copied_as)
+                continue
+            self.camera.download_picture(entry.url, path, size=size, date=entry.date)
+            report = IngestReport(entry, path, size, time.monotonic() - since)
+            reports.append(report)
+            colors.debug(f'Ingested {os.path.basename(path)} in {report.latency * 1000:.0f}ms')
+            if self.index is not None:
+                self.index.add(key, path)
+        self.seen += len(items)
+        if self.index is not None:
+            self.index.commit()
+        # Browsing and downloading left the camera in playmode, the next shot needs recmode
+        self.camera.enter_recmode()
+        self.reports.extend(reports)
+        return reports
+
+    def capture(self, timeout=10.0, poll_interval=0.1):
+        # Take a picture and wait for its files, latencies are measured from the capture request
+        self.camera.enter_recmode()
+        sent = time.monotonic()
+        if not self.camera.capture_photo().ok:
+            raise Exception("Capture failed")
+        # The camera may still be writing the card when it replies
+        while time.monotonic() - sent < timeout:
+            reports = self.poll(since=sent)
+            if reports:
+                return reports
+            time.sleep(poll_interval)
+        raise Exception("No new file appeared {0}s after the capture".format(timeout))
+
+    def watch(self, poll_interval=0.5):
+        # Pick up shots taken on the camera body until interrupted
+        while True:
+            for report in self.poll():
+                yield report
+            time.sleep(poll_interval)
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+
+
+def make_parser(tether_parser: argparse.ArgumentParser):
+    tether_parser.add_argument('-v', '--verbose', action='store_true', help='Print verbose output')
+    tether_parser.add_argument('-i', '--ip', help='IP address of camera', type=str, metavar='IP', default="192.168.54.1")
+    tether_parser.add_argument('-o', '--output', help='Output directory', required=True, type=str)
+    tether_parser.add_argument('-c', '--capture', help='Take a picture every time Enter is pressed instead of waiting for shots taken on the camera', action='store_true')
+    tether_parser.add_argument('-n', '--interval', help='Seconds between two checks for new files', type=float, default=0.5)
+    tether_parser.add_argument('-x', '--if-exists', help='What to do if a different file with the same name already exists', choices=['skip', 'overwrite', 'rename'], default='rename', type=str)
+    tether_parser.add_argument('--raw-first', help='Download files in card order instead of JPEGs first', action='store_true')
+    tether_parser.add_argument('--no-index', help='Do not record the files in the transfer index', action='store_true')
+    tether_parser.add_argument('--soap-port', help='Port of the camera\'s ContentDirectory service', type=int, default=60606)
+
+
+def print_reports(reports):
+    for report in reports:
+        print(f'{os.path.basename(report.path)} on disk {report.latency * 1000:.0f}ms after the shot')
+
+
+def main(args):
+    colors.verbose = args.verbose
+    camera = CameraControl(args.ip, soap_port=args.soap_port)
+    tether = Tether(camera, args.output, jpeg_first=not args.raw_first, use_index=not args.no_index, if_exists=args.if_exists)
+    try:
+        if args.capture:
+            colors.info('Press Enter to take a picture, Ctrl-C to stop')
+            while True:
+                input()
+                print_reports(tether.capture())
+        else:
+            colors.info('Waiting for new pictures, Ctrl-C to stop')
+            for report in tether.watch(args.interval):
+                print_reports([report])
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        tether.close()
+        camera.close()
+    if tether.reports:
+        latencies = sorted(report.latency for report in tether.reports)
+        print(f'Ingested {len(latencies)} files, median latency {latencies[len(latencies) // 2] * 1000:.0f}ms, max {latencies[-1] * 1000:.0f}ms')
@@ -0,0 +1,252 @@
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import colors
+from . import exposure
+from .lumix_control import CameraControl
+from .tether import Tether
+
+
+class FrameReport:
+    # Timing of one timelapse frame, in seconds. error is how late (positive) or early
+    # the shutter fired compared to the schedule, assuming the camera acts halfway
+    # through the round trip like ShotReport does.
+    __slots__ = ("index", "scheduled", "sent", "latency", "error", "ok", "exposure")
+
+    def __init__(self, index, scheduled, sent, latency, ok, exposure=None):
+        self.index = index
+        self.scheduled = scheduled
+        self.sent = sent
+        self.latency = latency
+        self.error = sent + latency / 2 - scheduled
+        self.ok = ok
+        self.exposure = exposure
+
+    def __repr__(self):
+        return "FrameReport({0}, error={1:+.1f}ms, latency={2:.1f}ms, ok={3})".format(
+            self.index, self.error * 1000, self.latency * 1000, self.ok)
+
+
+def ramp_exposure(start, end, fraction):
+    # Interpolate between two {"iso", "shutter", "aperture"} dicts in APEX space, where
+    # equal steps are equal changes of exposure. Returns values the exposure resolvers accept.
+    values = {}
+    for name in start:
+        if name not in end:
+            continue
+        if name == "iso":
+            low, high = exposure.iso_stop(start[name]).apex, exposure.iso_stop(end[name]).apex
+            values[name] = 3.125 * 2 ** (low + (high - low) * fraction)
+        elif name == "shutter":
+            low, high = exposure.shutter_stop(start[name]).apex, exposure.shutter_stop(end[name]).apex
+            values[name] = 2 ** -(low + (high - low) * fraction)
+        elif name == "aperture":
+            low, high = exposure.aperture_stop(start[name]).apex, exposure.aperture_stop(end[name]).apex
+            values[name] = 2 ** ((low + (high - low) * fraction) / 2)
+    return values
+
+
+class Timelapse:
+    # Captures a frame every `interval` seconds against the monotonic clock, so command
+    # latency never accumulates: frame i is due at origin + i * interval, and the request
+    # leaves early by half the measured round trip.
+    # A slot that is already more than max_late seconds behind (e.g. the previous capture
+    # was slow) is counted as missed instead of being fired late.
+    # ramp=(start, end) changes the exposure from frame to frame, see ramp_exposure.
+    # With download set to a directory, new files are fetched between frames, but only
+    # when the last download times say it will be done before the next slot.
+    def __init__(self, camera, interval, frames=None, ramp=None, download=None, max_late=None, smoothing=0.3):
+        if ramp is not None and not frames:
+            raise Exception("An exposure ramp needs a number of frames")
+        self.camera = camera
+        self.interval = interval
+        self.frames = frames
+        self.ramp = ramp
+        self.download = download
+        self.max_late = interval / 2 if max_late is None else max_late
+        self.smoothing = smoothing
+        self.latency = None
+        self.origin = None
+        self.current_exposure = None
+        self.reports = []
+        self.missed = []
+        self.running = False
+        self.stop_event = threading.Event()
+        # Browsing and downloading switch the camera to playmode, captures need recmode
+        self.mode_lock = threading.Lock()
+        # One download thread, which also owns the Tether (and its sqlite index)
+        self.executor = ThreadPoolExecutor(max_workers=1) if download else None
+        self.tether = None
+        self.download_time = 0.0
+        self.downloaded = []
+        self.next_slot = None
+
+    def lead(self):
+        return self.latency / 2 if self.latency is not None else 0.0
+
+    def run(self, origin=None):
+        self.running = True
+        self.stop_event.clear()
+        if self.executor is not None and self.tether is None:
+            self.tether = self.executor.submit(Tether, self.camera, self.download).result()
+        if self.ramp is not None:
+            self.apply_ramp(0)
+        if self.latency is None:
+            # Estimate the round trip before the first frame, so it is compensated too
+            sent = time.monotonic()
+            self.camera.get_state()
+            self.latency = time.monotonic() - sent
+        # The first request leaves right away and lands half a round trip later
+        self.origin = time.monotonic() + self.lead() if origin is None else origin
+        index = 0
+        try:
+            while self.running and (self.frames is None or index < self.frames):
+                scheduled = self.origin + index * self.interval
+                self.next_slot = scheduled
+                late = time.monotonic() + self.lead() - scheduled
+                if late > self.max_late:
+                    self.missed.append(index)
+                    colors.warning(f'Frame {index} missed, {late * 1000:.0f}ms behind schedule')
+                    index += 1
+                    continue
+                if self.stop_event.wait(max(scheduled - self.lead() - time.monotonic(), 0)):
+                    break
+                report = self.capture(index, scheduled)
+                self.reports.append(report)
+                colors.debug(f'Frame {index}: {report.error * 1000:+.1f}ms, latency {report.latency * 1000:.0f}ms' + ('' if report.ok else ', capture failed'))
+                index += 1
+                self.next_slot = self.origin + index * self.interval
+                if self.ramp is not None and index < self.frames:
+                    self.apply_ramp(index)
+                if self.executor is not None:
+                    self.executor.submit(self.fetch_new)
+        finally:
+            self.running = False
+        return self.reports
+
+    def capture(self, index, scheduled):
+        with self.mode_lock:
+            self.camera.enter_recmode()
+            sent = time.monotonic()
+            try:
+                ok = self.camera.capture_photo().ok
+            except Exception:
+                ok = False
+            latency = time.monotonic() - sent
+        self.latency = latency if self.latency is None else self.latency + self.smoothing * (latency - self.latency)
+        return FrameReport(index, scheduled, sent, latency, ok, self.current_exposure)
+
+    def apply_ramp(self, index):
+        # Set the exposure of the next frame right after the current one was taken
+        start, end = self.ramp
+        values = ramp_exposure(start, end, index / max(self.frames - 1, 1))
+        self.current_exposure = values
+        with self.mode_lock:
+            self.camera.enter_recmode()
+            self.camera.apply_exposure(values.get("iso"), values.get("shutter"), values.get("aperture"))
+
+    def fetch_new(self):
+        # Runs on the download thread after each capture
+        try:
+            self.fetch_new_files()
+        except Exception as e:
+            colors.error(f'Downloading new frames failed: {e}')
+
+    def fetch_new_files(self):
+        if self.next_slot is not None and time.monotonic() + self.download_time * 1.2 > self.next_slot - self.lead():
+            # Not enough time before the next frame, the files will be fetched after a later one
+            return
+        started = time.monotonic()
+        with self.mode_lock:
+            reports = self.tether.poll()
+        if not reports:
+            return
+        self.downloaded.extend(report.path for report in reports)
+        duration = time.monotonic() - started
+        self.download_time = duration if not self.download_time else self.download_time + self.smoothing * (duration - self.download_time)
+
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
+
+    def close(self):
+        self.stop()
+        if self.executor is not None:
+            # Whatever was skipped to keep the schedule is fetched now
+            self.next_slot = None
+            if self.tether is not None:
+                self.executor.submit(self.fetch_new)
+                self.executor.submit(self.tether.close)
+            self.executor.shutdown()
+            self.executor = None
+
+    def stats(self):
+        errors = sorted(abs(report.error) for report in self.reports)
+        return {
+            "frames": len(self.reports),
+            "failed": sum(1 for report in self.reports if not report.ok),
+            "missed": len(self.missed),
+            "mean_abs_error_ms": sum(errors) / len(errors) * 1000 if errors else 0.0,
+            "p95_abs_error_ms": errors[min(int(len(errors) * 0.95), len(errors) - 1)] * 1000 if errors else 0.0,
+            "max_abs_error_ms": errors[-1] * 1000 if errors else 0.0,
+            "mean_latency_ms": sum(report.latency for report in self.reports) / len(self.reports) * 1000 if self.reports else 0.0,
+            "downloaded": len(self.downloaded),
+        }
+
+
+RAMP_RESOLVERS = {"iso": exposure.iso_stop, "shutter": exposure.shutter_stop, "aperture": exposure.aperture_stop}
+
+
+def parse_ramp(values):
+    # ["iso=200:800", "shutter=1/250:1/30"] -> ({"iso": "200", ...}, {"iso": "800", ...})
+    start, end = {}, {}
+    for value in values:
+        name, _, limits = value.partition("=")
+        first, _, last = limits.partition(":")
+        if name not in RAMP_RESOLVERS or not last:
+            raise argparse.ArgumentTypeError(f'Invalid ramp {value}, expected e.g. iso=200:800')
+        for limit in (first, last):
+            # Auto ISO, bulb and 60s have no place on the APEX scale to interpolate along
+            try:
+                stop = RAMP_RESOLVERS[name](limit)
+            except Exception as e:
+                raise argparse.ArgumentTypeError(f'Invalid ramp {value}: {e}')
+            if stop.apex is None:
+                raise argparse.ArgumentTypeError(f'Invalid ramp {value}: {stop.label} can\'t be ramped')
+        start[name], end[name] = first, last
+    return start, end
+
+
+def make_parser(timelapse_parser: argparse.ArgumentParser):
+    timelapse_parser.add_argument('-v', '--verbose', action='store_true', help='Print every frame')
+    timelapse_parser.add_argument('-i', '--ip', help='IP address of camera', type=str, metavar='IP', default="192.168.54.1")
+    timelapse_parser.add_argument('-n', '--interval', help='Seconds between frames', type=float, required=True)
+    timelapse_parser.add_argument('-f', '--frames', help='Number of frames (default: until interrupted)', type=int)
+    timelapse_parser.add_argument('-o', '--output', help='Download new frames into this directory between captures', type=str)
+    timelapse_parser.add_argument('--ramp', help='Exposure ramp over the whole timelapse, e.g. iso=200:800, shutter=1/250:1/30 or aperture=4:8', action='append', default=[])
+    timelapse_parser.add_argument('--soap-port', help='Port of the camera\'s ContentDirectory service', type=int, default=60606)
+
+
+def main(args):
+    colors.verbose = args.verbose
+    try:
+        ramp = parse_ramp(args.ramp) if args.ramp else None
+    except argparse.ArgumentTypeError as e:
+        colors.error(str(e))
+        exit(1)
+    camera = CameraControl(args.ip, soap_port=args.soap_port)
+    timelapse = Timelapse(camera, args.interval, args.frames, ramp, args.output)
+    try:
+        timelapse.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        timelapse.close()
+        camera.close()
+    stats = timelapse.stats()
+    print(f'{stats["frames"]} frames, {stats["missed"]} missed, {stats["failed"]} failed captures')
+    print(f'Trigger error: mean {stats["mean_abs_error_ms"]:.1f}ms, p95 {stats["p95_abs_error_ms"]:.1f}ms, max {stats["max_abs_error_ms"]:.1f}ms')
+    if args.output:
+        print(f'Downloaded {stats["downloaded"]} files to {args.output}')
@@ -12,6 +12,9 @@ setuptools.setup(
     long_description_content_type='text/markdown',
     url='https://github.com/tarneaux/lumix-control',
     install_requires=requirements,
+    extras_require={
+        'async': ['aiohttp'],
+    },
     packages=setuptools.find_packages(),
     classifiers=[
         'Programming Language :: Python :: 3',
@@ -0,0 +1,89 @@
+import argparse
+import os
+
+import pytest
+
+from lumix_control import copy
+from lumix_control.lumix_control import part_source
+from lumix_control.mock_camera import MockCamera
+
+KB = 1024
+FILE_MIX = {"JPG": (3, 100 * KB, 300 * KB), "RAW": (1, 300 * KB, 600 * KB)}
+
+
+@pytest.fixture
+def mock():
+    with MockCamera(card_size=6, file_mix=FILE_MIX) as mock:
+        yield mock
+
+
+def run_copy(mock, output, *extra):
+    parser = argparse.ArgumentParser()
+    copy.make_parser(parser)
+    output = ["-o", str(output)] if output is not None else []
+    args = parser.parse_args(["wifi", "-i", mock.cam_ip, "--soap-port", str(mock.soap_port), *output, "-j", "2", *extra])
+    copy.main(args)
+
+
+def originals(mock):
+    # (local name, size) of every original on the mock card
+    for item in mock.items:
+        name, size, _ = item.resources()[0]
+        yield name.replace("DO", "P").replace(".RAW", ".RW2"), size
+
+
+def test_copy_wifi(mock, tmp_path):
+    run_copy(mock, tmp_path)
+    for name, size in originals(mock):
+        with open(tmp_path / name, "rb") as f:
+            assert f.read() == mock.read(0, size)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+
+def write_part(mock, path, name, data, date=None):
+    item = mock.items[0]
+    original, size, _ = item.resources()[0]
+    url = "http://{0}/{1}".format(mock.cam_ip, original)
+    (path / (name + ".part")).write_bytes(data)
+    (path / (name + ".part.source")).write_text(part_source(url, size, item.date if date is None else date))
+
+
+def test_copy_wifi_resumes_part_file(mock, tmp_path):
+    name, size = next(originals(mock))
+    # A prefix the camera would never send: if it is still there afterwards,
+    # only the rest of the file was requested
+    prefix = b"\0" * (size // 2)
+    write_part(mock, tmp_path, name, prefix)
+    run_copy(mock, tmp_path)
+    with open(tmp_path / name, "rb") as f:
+        assert f.read() == prefix + mock.read(len(prefix), size - len(prefix))
+    assert not (tmp_path / (name + ".part")).exists()
+    assert not (tmp_path / (name + ".part.source")).exists()
+
+
+def test_copy_wifi_restarts_part_of_another_file(mock, tmp_path):
+    name, size = next(originals(mock))
+    # Same name and url, but left by a file taken at another date
+    write_part(mock, tmp_path, name, b"\0" * (size // 2), date="2001-01-01T00:00:00")
+    run_copy(mock, tmp_path)
+    with open(tmp_path / name, "rb") as f:
+        assert f.read() == mock.read(0, size)
+
+
+def test_copy_wifi_skips_imported_files(mock, tmp_path):
+    run_copy(mock, tmp_path)
+    mtimes = {name: os.stat(tmp_path / name).st_mtime_ns for name, _ in originals(mock)}
+    run_copy(mock, tmp_path)
+    assert {name: os.stat(tmp_path / name).st_mtime_ns for name, _ in originals(mock)} == mtimes
+
+
+def test_copy_wifi_selected_previews(mock, tmp_path):
+    previews = tmp_path / "previews"
+    run_copy(mock, None, "--previews", str(previews))
+    kept = sorted(name for name in os.listdir(previews) if name.endswith(".jpg"))
+    assert len(kept) == len(mock.items)
+    os.remove(previews / kept[0])
+    run_copy(mock, tmp_path / "selected", "--select", str(previews))
+    names = [name for name, _ in originals(mock)]
+    copied = {name for name in os.listdir(tmp_path / "selected") if not name.startswith(".")}
+    assert copied == set(names[1:])
@@ -0,0 +1,89 @@
+import pytest
+
+from lumix_control import exposure
+from lumix_control.responses import parse_lens_info
+
+# Aperture f/4 to f/11, shutter 4s to 1/250
+LENS = parse_lens_info("ok,1792/256,1024/256,2048/256,-512/256,0,on,42,14,on,128/1024,on")
+
+
+@pytest.mark.parametrize("value, label", [
+    ("250", "1/250"),
+    ("5", "1/5"),
+    ("6", "1/6"),
+    # Bare numeric strings are denominators even when they are not table keys
+    ("5.5", "1/5"),
+    ("3.3", "1/3.2"),
+    ("300", "1/320"),
+    ("2s", '2"'),
+    ('2"', '2"'),
+    ("1.3s", '1.3"'),
+    ("60s", '60"'),
+    ("B", "B"),
+])
+def test_shutter_strings(value, label):
+    assert exposure.shutter_stop(value).label == label
+
+
+@pytest.mark.parametrize("value, label", [
+    ("1/250", "1/250"),
+    ("1/300", "1/320"),
+    ("1/2", "1/2"),
+    ("4/1", '4"'),
+])
+def test_shutter_fractions(value, label):
+    assert exposure.shutter_stop(value).label == label
+
+
+@pytest.mark.parametrize("value, label", [
+    (1 / 250, "1/250"),
+    (0.5, "1/2"),
+    (2, '2"'),
+    (4, '4"'),
+])
+def test_shutter_numbers_are_seconds(value, label):
+    assert exposure.shutter_stop(value).label == label
+
+
+@pytest.mark.parametrize("value", [250, 250.0, 1 / 8000, "8000", "1/8000", "100s", 0, "0"])
+def test_shutter_out_of_range(value):
+    with pytest.raises(ValueError):
+        exposure.shutter_stop(value)
+
+
+def test_shutter_hint_uses_integer_denominator():
+    with pytest.raises(ValueError, match='"250" for 1/250'):
+        exposure.shutter_stop(250.0)
+
+
+def test_shutter_lens_limits():
+    assert exposure.shutter_stop("250", LENS).label == "1/250"
+    assert exposure.shutter_stop(4, LENS).label == '4"'
+    for value in ("1000", 1 / 1000, "8s", 8):
+        with pytest.raises(ValueError):
+            exposure.shutter_stop(value, LENS)
+
+
+@pytest.mark.parametrize("value, label", [
+    (5.6, "f/5.6"),
+    ("5.5", "f/5.6"),
+    ("f/8", "f/8"),
+    ("F/2.8", "f/2.8"),
+])
+def test_aperture(value, label):
+    assert exposure.aperture_stop(value).label == label
+
+
+def test_aperture_lens_limits():
+    assert exposure.aperture_stop(2.8, LENS).label == "f/4"
+    assert exposure.aperture_stop(22, LENS).label == "f/11"
+
+
+@pytest.mark.parametrize("value, label", [
+    (200, "ISO 200"),
+    ("210", "ISO 200"),
+    (1100, "ISO 1000"),
+    ("auto", "ISO auto"),
+])
+def test_iso(value, label):
+    assert exposure.iso_stop(value).label == label
@@ -0,0 +1,53 @@
+from lumix_control import responses
+
+OK = '<?xml version="1.0" encoding="UTF-8"?><camrply><result>{0}</result>{1}</camrply>'
+
+
+def test_reply():
+    assert responses.parse_reply(OK.format("ok", "").encode()).ok
+    reply = responses.parse_reply(OK.format("err_busy", ""))
+    assert not reply.ok and reply.result == "err_busy"
+    assert responses.parse_reply(b"ok,1,2").ok
+    assert responses.parse_reply(b"").result is None
+
+
+def test_state():
+    state = responses.parse_state(OK.format("ok", "<state><batt>2/3</batt><cammode>play</cammode><rec>off</rec>"
+                                                  "<remaincapacity>512</remaincapacity></state>").encode())
+    assert state.ok
+    assert state.battery == "2/3" and state.mode == "play" and not state.recording
+    assert state.remaining_capacity == 512
+
+
+def test_state_signature_ignores_volatile_fields():
+    first = responses.parse_state(OK.format("ok", "<state><batt>3/3</batt><cammode>rec</cammode></state>"))
+    second = responses.parse_state(OK.format("ok", "<state><batt>1/3</batt><cammode>rec</cammode></state>"))
+    third = responses.parse_state(OK.format("ok", "<state><batt>1/3</batt><cammode>play</cammode></state>"))
+    assert first.signature() == second.signature() != third.signature()
+
+
+def test_unparsable_state():
+    state = responses.parse_state(b"<camrply><result>ok")
+    assert state.result is None and state.fields == {}
+
+
+def test_setting():
+    setting = responses.parse_setting(OK.format("ok", '<settingvalue iso="200"></settingvalue>').encode(), "iso")
+    assert setting.ok and setting.value == "200"
+    assert responses.parse_setting(OK.format("ok", "<settingvalue/>"), "iso").value is None
+
+
+def test_lens_info():
+    lens = responses.parse_lens_info(b"ok,2304/256,768/256,3072/256,-1536/256,0,on,42,14,on,128/1024,on")
+    assert lens.ok
+    assert (lens.max_aperture, lens.min_aperture) == (9.0, 3.0)
+    assert (lens.max_shutter, lens.min_shutter) == (12.0, -6.0)
+    assert (lens.max_zoom, lens.min_zoom) == (42, 14)
+    error = responses.parse_lens_info(OK.format("err_non_support", ""))
+    assert not error.ok and error.max_aperture is None
+
+
+def test_focus_position():
+    focus = responses.parse_focus_position(b"ok,512,1023")
+    assert focus.ok and (focus.position, focus.maximum) == (512, 1023)
+    assert not responses.parse_focus_position(OK.format("err_param", "")).ok
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from lumix_control.copy.index import TransferIndex
+from lumix_control.lumix_control import CameraControl
+from lumix_control.mock_camera import MockCamera
+from lumix_control.tether import Tether
+
+FILE_MIX = {"JPG": (1, 10 * 1024, 20 * 1024)}
+
+
+@pytest.fixture
+def camera():
+    with MockCamera(card_size=1, file_mix=FILE_MIX) as mock:
+        camera = CameraControl(mock.cam_ip, soap_port=mock.soap_port)
+        yield mock, camera
+        camera.close()
+
+
+def test_tether_renames_instead_of_overwriting(camera, tmp_path):
+    mock, camera = camera
+    (tmp_path / "P1001.JPG").write_bytes(b"from another card")
+    tether = Tether(camera, str(tmp_path))
+    mock.add_item()
+    try:
+        reports = tether.poll()
+    finally:
+        tether.close()
+    assert [os.path.basename(report.path) for report in reports] == ["P1001_1.JPG"]
+    assert (tmp_path / "P1001.JPG").read_bytes() == b"from another card"
+
+
+def test_tether_files_are_in_the_copy_index(camera, tmp_path):
+    mock, camera = camera
+    tether = Tether(camera, str(tmp_path))
+    item = mock.add_item()
+    try:
+        tether.poll()
+    finally:
+        tether.close()
+    original, size, _ = item.resources()[0]
+    index = TransferIndex(str(tmp_path))
+    try:
+        assert (original, size, item.date) in index
+    finally:
+        index.close()